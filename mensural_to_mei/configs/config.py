@@ -3,12 +3,26 @@ RESCALE = True
 IMAGE_SIZE = [1024, 1024]
 STAFF_SIZE = [1408, 192]
 SYMBOL_SIZE = [224, 224]
+BATCH_SIZE = 32
+# threads per inference run, None uses all cores; lower it when running several conversions in parallel
+INTRA_OP_THREADS = None
+# number of images read and preprocessed in background threads ahead of the detection
+PREFETCH_IMAGES = 4
+# save the optimized graph of each model next to it and reuse it on later program starts
+SAVE_OPTIMIZED_MODELS = False
+# noise filter used in preprocessing: 'median', 'nlmeans' or None to skip denoising
+DENOISE_FILTER = 'median'
+# folder caching the detected symbols and pitches of already converted images (e.g. '.cache'), None disables the cache
+DETECTION_CACHE_FOLDER = None
+# resolution of converted pdf pages, set PDF_TARGET_WIDTH (pixels) to derive it from the page width instead
+PDF_DPI = 300
+PDF_TARGET_WIDTH = None
+# render pdf pages with pdftocairo instead of pdftoppm
+PDF_USE_PDFTOCAIRO = False
 OUTPUT_FOLDERS = {
     'humdrum_output': 'humdrum_output',
     'mei_output': 'mei_output',
-    'pdf_images': 'pdf_images',
-    'pdf_temp': 'pdf_temp',
-    'preprocessed_images': 'preprocessed_images'
+    'pdf_images': 'pdf_images'
 }
 MODEL_PATHES = {
     'staffs': 'models/object_detection/best_staff.onnx',
@@ -17,6 +31,13 @@ MODEL_PATHES = {
     'clef': 'models/classification/best_clef.onnx',
     'mensuration': 'models/classification/best_mensuration.onnx'
 }
+# INT8 classifiers created by mensural_to_mei/pitch_detection/quantize_models.py
+USE_QUANTIZED_CLASSIFIERS = False
+QUANTIZED_MODEL_PATHES = {
+    'all_symbols': 'models/classification/best_all_symbols.int8.onnx',
+    'clef': 'models/classification/best_clef.int8.onnx',
+    'mensuration': 'models/classification/best_mensuration.int8.onnx'
+}
 LABEL_PATHES = {
     'staffs': 'models/object_detection/best_staff.yaml',
     'symbols': 'models/object_detection/best_symbols.yaml',
@@ -42,45 +42,398 @@ Note:
     files are saved incrementally based on the provided metadata.
 """
 
+import itertools
 import os
+import secrets
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from tqdm import tqdm
 sys.path.append('../mensural_to_mei')
 
 from datetime import datetime
-import pickle
-from mensural_to_mei.utils import convert_to_combined_list_with_metadata, generate_random_numbers, prettyprint
+from mensural_to_mei.configs import config
+from mensural_to_mei.utils import convert_to_combined_list_with_metadata, load_pickle, prettyprint
 from lxml import etree
 from colorama import just_fix_windows_console
 from termcolor import cprint
 
 just_fix_windows_console()
 
-# global counters
-id_counter = 0
-staff_counter = 0
-layer_counter = 0
-used_filenames = []
+# filenames already saved in the current conversion
+used_filenames = set()
+_PENDING_WRITES = []
 VERSION = '1.0.0'
+_XMLID = '{http://www.w3.org/XML/1998/namespace}id'
+
+# symbol lookup tables, built once at import time
+_RESTS_MEI = {
+    'r-lo': 'longa',
+    'r-br': 'brevis',
+    'r-sb': 'semibrevis',
+    'r-mi': 'minima',
+    'r-sm': 'semiminima',
+    'r-fu': 'fusa',
+    'r-se': 'semifusa',
+}
+
+_NOTES_MEI = {
+    'ma': 'maxima',
+    'lo': 'longa',
+    'bre': 'brevis',
+    'sebre': 'semibrevis',
+    'mi': 'minima',
+    'sm': 'semiminima',
+    'fu': 'fusa',
+    'sf': 'semifusa',
+    'br': 'brevis',
+    'sb': 'semibrevis',
+    'li': 'semibrevis',
+}
+
+_NOTES_HUMDRUM = {
+    'ma': 'X',
+    'lo': 'L',
+    'bre': 'S',
+    'sebre': 's',
+    'mi': 'M',
+    'sm': 'm',
+    'fu': 'U',
+    'sf': 'u',
+    'br': 'S~',
+    'sb': 's~',
+    'li': '[s'
+}
+
+_RESTS_HUMDRUM = {
+    'r-lo': 'Lr',
+    'r-br': 'Sr',
+    'r-sb': 'sr',
+    'r-mi': 'Mr',
+    'r-sm': 'mr',
+    'r-fu': 'Ur',
+    'r-se': 'ur',
+}
+
+_CLEFS_HUMDRUM = {
+    "c-c-g": "*clefC2",
+    "c-c-e": "*clefC1",
+    "c-c-b": "*clefC3",
+    "c-c-d": "*clefC4",
+    "c-g": "*clefG2",
+    "c-f-b": "*clefF3",
+    "c-f": "*clefF4"
+}
+
+# map mensural note steps to integers
+_MENSURAL_NOTE_STEPS = {'c0': 0, 'd0': 1, 'e0': 2, 'f0': 3, 'g0': 4, 'a0': 5, 'b0': 6,
+                        'c1': 7, 'd1': 8, 'e1': 9, 'f1': 10, 'g1': 11, 'a1': 12, 'b1': 13,
+                        'c2': 14, 'd2': 15, 'e2': 16, 'f2': 17, 'g2': 18, 'a2': 19, 'b2': 20
+                        }
+
+# map relative note steps to note names
+_RELATIVE_NOTE_STEPS = {
+    -14: 'c', -13: 'd', -12: 'e', -11: 'f', -10: 'g', -9: 'a', -8: 'b',
+    -7: 'c', -6: 'd', -5: 'e', -4: 'f', -3: 'g', -2: 'a', -1: 'b',
+    0: 'c', 1: 'd', 2: 'e', 3: 'f', 4: 'g', 5: 'a', 6: 'b',
+    7: 'c', 8: 'd', 9: 'e', 10: 'f', 11: 'g', 12: 'a', 13: 'b'
+}
+
+# map detected clefs to mei clef shape and line
+_CLEF_SHAPE_LINE = {
+    'c-g': ('G', '2'),
+    'c-c-e': ('C', '1'),
+    'c-c-g': ('C', '2'),
+    'c-c-b': ('C', '3'),
+    'c-c-d': ('C', '4'),
+    'c-f-b': ('F', '3'),
+    'c-f': ('F', '4')
+}
+
+# map detected mensurations to mei sign and slash
+_MENSUR_TABLE = {
+    'met_c': ('C', ''),
+    'al-br': ('C', '1'),
+    'met_o_cut': ('O', '1')
+}
+
+# map detected clefs to the mensural note step of their reference line
+_CLEF_TO_CLEFLINE = {
+    'c-c-g': _MENSURAL_NOTE_STEPS['g1'],
+    'c-c-e': _MENSURAL_NOTE_STEPS['e1'],
+    'c-c-b': _MENSURAL_NOTE_STEPS['b1'],
+    'c-c-d': _MENSURAL_NOTE_STEPS['d2'],
+    'c-g': _MENSURAL_NOTE_STEPS['c1'],
+    'c-f-b': _MENSURAL_NOTE_STEPS['f2'],
+    'c-f': _MENSURAL_NOTE_STEPS['a2']
+}
+
+
+def _compute_relative_pitch(rel_pitch: int) -> tuple:
+    """ returns octave shift and note name for a relative pitch """
+    if -7 <= rel_pitch < 0:
+        return -1, _RELATIVE_NOTE_STEPS[7 + rel_pitch]
+    elif rel_pitch > 6:
+        return 1, _RELATIVE_NOTE_STEPS[rel_pitch]
+    elif -14 <= rel_pitch < -7:
+        return -2, _RELATIVE_NOTE_STEPS[7 + rel_pitch]
+    return 0, _RELATIVE_NOTE_STEPS[rel_pitch]
+
+
+# map relative pitches (note step minus clef line) to octave shift and note name
+_REL_PITCH_TABLE = {rel: _compute_relative_pitch(rel) for rel in range(-14, 14)}
+
+# map octaves to (uppercase, repetitions) of the humdrum pitch name
+_OCT_SUFFIX = {2: (True, 2), 3: (True, 1), 4: (False, 1), 5: (False, 2)}
+
+
+def _build_humdrum_pitch(oct: int, pname: str) -> str:
+    """ returns the humdrum spelling of a pitch name in the given octave """
+    upper, rep = _OCT_SUFFIX[oct]
+    return (pname.upper() if upper else pname) * rep
+
+
+# map (octave, pitch name) to the humdrum pitch suffix
+_HUMDRUM_PITCH_SUFFIX = {(o, p): _build_humdrum_pitch(o, p) for o in _OCT_SUFFIX for p in 'cdefgab'}
+
+# (tag, parent) pairs of the mei declarations in document order
+_DECL_SCHEMA = (
+    ('music', 'mei'),
+    ('body', 'music'),
+    ('mdiv', 'body'),
+    ('score', 'mdiv'),
+    ('scoreDef', 'score'),
+    ('staffGrp', 'scoreDef'),
+    ('staffDef', 'staffGrp'),
+    ('clef', 'staffDef'),
+    ('keySig', 'staffDef'),
+    ('section', 'score'),
+    ('staff', 'section'),
+    ('layer', 'staff')
+)
+
+# declarations which get an xml:id on creation
+_DECL_WITH_ID = frozenset({'mdiv', 'score', 'scoreDef', 'staffGrp', 'staffDef', 'section', 'staff', 'layer'})
+
+# fixed attributes of the mei declarations
+_STATIC_ATTRS = {
+    'staffDef': {'n': '1', 'notationtype': 'mensural.white', 'lines': '5'},
+    'staff': {'n': '1'},
+    'layer': {'n': '1'}
+}
+
+_NOTE_KEYS = frozenset(_NOTES_MEI)
+_REST_KEYS = frozenset(_RESTS_MEI)
+
+
+def _new_id(prefix: str) -> str:
+    """ returns a new random xml:id with the given prefix """
+    return f'{prefix}-{secrets.token_hex(8)}'
+
+
+def _sub(parent: etree.Element, tag: str, id_prefix: str, **attrs) -> etree.Element:
+    """ creates a sub element with a new xml:id and the given attributes in one call """
+    attrib = {_XMLID: _new_id(id_prefix)}
+    attrib.update(attrs)
+    return etree.SubElement(parent, tag, attrib=attrib)
+
+
+class _ConversionState:
+    """ mutable state shared by the symbol handlers during conversion """
+
+    def __init__(self, stafflist: list, metadata: dict, humdrum: bool):
+        self.stafflist = stafflist
+        self.metadata = metadata
+        self.humdrum = humdrum
+        self.humdrum_lines = [bytearray(b'**mens')]
+        self.humdrum_line = ''
+        self.filename = metadata[0]
+        self.filename_counter = 0
+        self.ix_staff = 0
+        self.first_staff = True
+        self.saved = False
+        self.clef = None
+        self.sharp_found = False
+        self.flat_found = False
+        self.ligature = False
+        self.xml_lig = None
+        self.mensur = None
+        self.new_mei()
+
+    def new_mei(self) -> None:
+        """ starts a new mei document for the next piece """
+        # the previous root cannot be reused with clear(): it is still
+        # queued in _PENDING_WRITES until the next flush_pending_writes
+        self.mei = etree.Element('mei', attrib={'xmlns': 'http://www.music-encoding.org/ns/mei',
+                                                'meiversion': '5.0'})
+
+        self.mei.append(create_meihead())
+
+        self.xml_clef, self.xml_keySign, self.xml_layer = create_mei_declarations(self.mei)
+
+
+def _append_humdrum_line(state: _ConversionState) -> None:
+    """ appends the current humdrum line, a custos also closes the system """
+    state.humdrum_lines.append(bytearray(state.humdrum_line, 'ascii'))
+
+    if 'custos' in state.humdrum_line:
+        state.humdrum_lines.append(bytearray(b'!!LO:LB:g=z'))
+        state.humdrum_lines.append(bytearray(b'=-'))
+
+
+def _handle_flat(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    state.flat_found = True
+
+
+def _handle_sharp(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    state.sharp_found = True
+
+
+def _handle_mens(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    if symbol['pitch'] == 'met_3_2':
+        state.mensur.set('num', '3')
+        state.mensur.set('numbase', '2')
+        if state.humdrum:
+            state.humdrum_lines[-1][-1:] = b''
+            state.humdrum_lines[-1] += b'3/2)'
+
+        return
+
+    sign, slash = analyse_mensuration(symbol)
+    attrs = {'prolatio': '2', 'sign': sign}
+    if slash:
+        attrs['slash'] = slash
+    state.mensur = _sub(state.xml_layer, 'mensur', 'mens', **attrs)
+
+    if state.humdrum:
+        sl = ''
+        if slash:
+            sl = '|'
 
+        state.humdrum_line = f'*met({sign}{sl})'
+        _append_humdrum_line(state)
 
-def increment_staffcounter():
-    global staff_counter
-    staff_counter += 1
-    return staff_counter
 
+def _handle_dot(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    _sub(state.xml_layer, 'dot', 'dot')
 
-def increment_idcounter():
-    global id_counter
-    id_counter += 1
-    return id_counter
+    if state.humdrum:
+        state.humdrum_lines[-1].insert(1, 0x3A)  # ':'
 
 
-def increment_layercounter():
-    global layer_counter
-    layer_counter += 1
-    return layer_counter
+def _handle_rest(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    t = symbol['type']
+    _sub(state.xml_layer, 'rest', 'rest', dur=_RESTS_MEI[t])
+
+    if state.humdrum:
+        state.humdrum_line = _RESTS_HUMDRUM[t]
+        _append_humdrum_line(state)
+
+
+def _handle_note(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    t = symbol['type']
+    humdrum = state.humdrum
+    xml_layer = state.xml_layer
+    oct, pname = analyse_note(state.clef, symbol['pitch'])
+
+    # collect all attributes first so the note is created in one call,
+    # the second note of a ligature is always a semibrevis
+    attrs = {'dur': 'semibrevis' if state.ligature else _NOTES_MEI[t], 'oct': str(oct), 'pname': pname}
+    if t == 'br' or t == 'sb':
+        attrs['colored'] = 'true'
+    if t != 'li':
+        if state.flat_found:
+            attrs['accid'] = 'f'
+        elif state.sharp_found:
+            attrs['accid'] = 's'
+    note = _sub(xml_layer, 'note', 'note', **attrs)
+
+    if humdrum:
+        line_humdrum = get_humdrum_pitch(oct, pname, _NOTES_HUMDRUM[t])
+
+    if t == 'li':
+        state.xml_lig = _sub(xml_layer, 'ligature', 'ligature', form='recta')
+        state.xml_lig.append(note)
+        state.ligature = True
+        if humdrum:
+            line_humdrum = get_humdrum_pitch(oct, pname, '[s')
+            state.humdrum_lines.append(bytearray(line_humdrum, 'ascii'))
+        return
+
+    if state.ligature:
+        state.xml_lig.append(note)
+        state.ligature = False
+        if humdrum:
+            line_humdrum = get_humdrum_pitch(oct, pname, 's')
+            line_humdrum += ']'
+
+    if state.sharp_found:
+        state.sharp_found = False
+        if humdrum:
+            line_humdrum += '#'
+
+    if state.flat_found:
+        state.flat_found = False
+        if humdrum:
+            line_humdrum += '-'
+
+    if humdrum:
+        state.humdrum_line = line_humdrum
+        _append_humdrum_line(state)
+
+
+def _handle_bar(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    _sub(state.xml_layer, 'barLine', 'barline', form='dbl')
+
+    if state.humdrum:
+        state.humdrum_lines.append(bytearray(b'=||'))
+        state.humdrum_lines.append(bytearray(b'*-'))
+
+    state.filename, state.filename_counter = save_mei_file(state.metadata, state.filename_counter, state.ix_staff,
+                                                           state.mei, state.filename, state.stafflist,
+                                                           state.humdrum_lines, state.humdrum)
+
+    state.new_mei()
+
+    state.first_staff = True
+    state.saved = True
+
+
+def _handle_custos(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    # the custos shows the pitch of the first note in the next staff
+    attrs = {}
+    if state.ix_staff < len(state.stafflist) - 1:
+        for next_symbol in state.stafflist[state.ix_staff + 1]:
+            if next_symbol['type'] in _NOTE_KEYS:
+                oct, pname = analyse_note(state.clef, next_symbol['pitch'])
+                attrs = {'oct': str(oct), 'pname': pname}
+                if state.humdrum:
+                    state.humdrum_line = get_humdrum_pitch(oct, pname, '*custos')
+                break
+
+    _sub(state.xml_layer, 'custos', 'custos', **attrs)
+
+    if state.humdrum:
+        _append_humdrum_line(state)
+
+
+def _handle_other(state: _ConversionState, symbol: dict, ix_symbol: int, staff: list) -> None:
+    # symbols without mei equivalent (e.g. clef changes) repeat the current humdrum line
+    if state.humdrum:
+        _append_humdrum_line(state)
+
+
+# dispatch table from symbol type to handler
+_HANDLERS = {
+    'flat': _handle_flat,
+    'sharp': _handle_sharp,
+    'mens': _handle_mens,
+    'dot': _handle_dot,
+    'bar': _handle_bar,
+    'custos': _handle_custos,
+    **{t: _handle_rest for t in _RESTS_MEI},
+    **{t: _handle_note for t in _NOTES_MEI}
+}
 
 
 def convert_to_mei_and_humdrum(
@@ -129,336 +482,118 @@ def convert_to_mei_and_humdrum(
     Conversion complete!
     """
 
-    ids = generate_random_numbers(10000)
-
     if not humdrum:
         cprint('Converting to MEI', 'blue')
     else:
         cprint('Converting to MEI and Humdrum', 'blue')
 
-    RESTS_MEI = {
-        'r-lo': 'longa',
-        'r-br': 'brevis',
-        'r-sb': 'semibrevis',
-        'r-mi': 'minima',
-        'r-sm': 'semiminima',
-        'r-fu': 'fusa',
-        'r-se': 'semifusa',
-    }
-
-    NOTES_MEI = {
-        'ma': 'maxima',
-        'lo': 'longa',
-        'bre': 'brevis',
-        'sebre': 'semibrevis',
-        'mi': 'minima',
-        'sm': 'semiminima',
-        'fu': 'fusa',
-        'sf': 'semifusa',
-        'br': 'brevis',
-        'sb': 'semibrevis',
-        'li': 'semibrevis',
-    }
-
-    NOTES_HUMDRUM = {
-        'ma': 'X',
-        'lo': 'L',
-        'bre': 'S',
-        'sebre': 's',
-        'mi': 'M',
-        'sm': 'm',
-        'fu': 'U',
-        'sf': 'u',
-        'br': 'S~',
-        'sb': 's~',
-        'li': '[s'
-    }
-
-    RESTS_HUMDRUM = {
-        'r-lo': 'Lr',
-        'r-br': 'Sr',
-        'r-sb': 'sr',
-        'r-mi': 'Mr',
-        'r-sm': 'mr',
-        'r-fu': 'Ur',
-        'r-se': 'ur',
-    }
-
-    CLEFS_HUMDRUM = {
-        "c-c-g": "*clefC2",
-        "c-c-e": "*clefC1",
-        "c-c-b": "*clefC3",
-        "c-c-d": "*clefC4",
-        "c-g": "*clefG2",
-        "c-f-b": "*clefF3",
-        "c-f": "*clefF4"
-    }
-
+    # create the output folders once instead of relying on them at every save
+    mei_dir = config.OUTPUT_FOLDERS['mei_output']
+    humdrum_dir = config.OUTPUT_FOLDERS['humdrum_output']
+    os.makedirs(mei_dir, exist_ok=True)
+    os.makedirs(humdrum_dir, exist_ok=True)
 
     stafflist, metadata = convert_to_combined_list_with_metadata(symbols_and_pitches)
 
-    filename_counter = 0
-    humdrum_string = ['**mens']
-    for ix_staff, staff in enumerate(tqdm(stafflist, desc="Converting")):
-        saved = False
-        if ix_staff == 0:
-            mei = etree.Element('mei')
-            mei.set('xmlns', 'http://www.music-encoding.org/ns/mei')
-            mei.set('meiversion', '5.0')
-
-            mei.append(create_meihead())
-
-            xml_clef, xml_keySign, xml_layer = create_mei_declarations(ids, mei)
-
-            filename = metadata[0]
-
-            first_staff = True
-
-        if first_staff:
-            first_staff = False
-            initial_flat_found = False
-            # check if first element in first staff is clef
-            if staff[0]['type'] == 'clef':
-                initial_clef = staff[0]
-                if staff[1]['type'] == 'flat':
-                    initial_flat_found = True
-            else:
-                # no clef found in the first staff, check if clef in subsequent staff
-                for i in range(1, len(stafflist)-1):
-                    if stafflist[i][0]['type'] == 'clef':
-                        initial_clef = stafflist[i][0]
-                        if stafflist[i][1]['type'] == 'flat':
-                            initial_flat_found = True
-
-                        break
-
-            if initial_clef is None:
-                # no clef found in the first staff and in the subsequent staffs
-                cprint('No clef was found in the staffs. Clefs are necessary to perform conversion!', 'red')
-                sys.exit('No clef was found in the staffs. Clefs are necessary to perform conversion!')
-            
-            clef = initial_clef        
-            initial_key = ''
-            shape, line = analyse_clef(initial_clef)
-            xml_clef.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'clef-{ids[increment_idcounter()]}')
-            xml_clef.set('shape', shape)
-            xml_clef.set('line', line)
-
-            if humdrum:
-                humdrum_string.append(CLEFS_HUMDRUM[initial_clef['pitch']])
-
-            if initial_flat_found:
-                xml_keySign.set(
-                    '{http://www.w3.org/XML/1998/namespace}id', f'keySig-{ids[increment_idcounter()]}')
-                xml_keySign.set('sig', '1f')
-                initial_key = 'flat'
-
-                if humdrum:
-                    humdrum_string.append('*k[b-]')
-        
-        sharp_found = False
-        flat_found = False
-        ligature = False
-        for ix_symbol, symbol in enumerate(staff):
-            t = symbol['type']
-            if symbol == initial_clef:
-                clef = initial_clef
-                continue
-
-            if t == initial_key and ix_symbol == 1:
-                continue
-
-            if t == initial_key and ix_symbol == 2:
-                if clef['pitch'] == 'c-c-g':
-                    continue
+    # filenames and queued files of a previous conversion in the same process must not affect this one
+    used_filenames.clear()
+    _PENDING_WRITES.clear()
+
+    try:
+        state = _ConversionState(stafflist, metadata, humdrum)
+
+        # local aliases for the symbol loop
+        get_handler = _HANDLERS.get
+        handle_other = _handle_other
+        # a progress bar is only worth its overhead for long runs or while debugging
+        staff_iterator = tqdm(stafflist, desc="Converting",
+                              disable=(not config.DEBUG_MODE and len(stafflist) < 64), mininterval=0.2)
+        for ix_staff, staff in enumerate(staff_iterator):
+            state.ix_staff = ix_staff
+            state.saved = False
+
+            if state.first_staff:
+                state.first_staff = False
+                initial_flat_found = False
+                # check if first element in first staff is clef
+                if staff[0]['type'] == 'clef':
+                    initial_clef = staff[0]
+                    if staff[1]['type'] == 'flat':
+                        initial_flat_found = True
+                else:
+                    # no clef found in the first staff, check if clef in subsequent staff
+                    for i in range(1, len(stafflist)-1):
+                        if stafflist[i][0]['type'] == 'clef':
+                            initial_clef = stafflist[i][0]
+                            if stafflist[i][1]['type'] == 'flat':
+                                initial_flat_found = True
 
-            if t == 'flat':
-                flat_found = True
-                continue
-
-            if t == 'sharp':
-                sharp_found = True
-                continue
-
-            if t == 'mens':
-                if symbol['pitch'] == 'met_3_2':
-                    mensur.set('num', '3')
-                    mensur.set('numbase', '2')
-                    if humdrum:
-                        humdrum_string[-1] = humdrum_string[-1][:-1] + '3/2)'
-                        
-                    continue
-                
-                mensur = etree.SubElement(xml_layer, 'mensur')
-                mensur.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'mens-{ids[increment_idcounter()]}')
-
-                sign, slash = analyse_mensuration(symbol)
-                mensur.set('prolatio', '2')
-                mensur.set('sign', sign)
-                if slash:
-                    mensur.set('slash', slash)
-
-                if humdrum:
-                    sl = ''
-                    if slash:
-                        sl = '|'
+                            break
 
-                    humdrum_line = f'*met({sign}{sl})'
+                if initial_clef is None:
+                    # no clef found in the first staff and in the subsequent staffs
+                    cprint('No clef was found in the staffs. Clefs are necessary to perform conversion!', 'red')
+                    sys.exit('No clef was found in the staffs. Clefs are necessary to perform conversion!')
+            
+                state.clef = initial_clef
+                initial_key = ''
+                shape, line = analyse_clef(initial_clef)
+                state.xml_clef.set(_XMLID, _new_id('clef'))
+                state.xml_clef.set('shape', shape)
+                state.xml_clef.set('line', line)
 
-            if t == 'dot':
-                dot = etree.SubElement(xml_layer, 'dot')
-                dot.set('{http://www.w3.org/XML/1998/namespace}id',
-                        f'dot-{ids[increment_idcounter()]}')
-                
                 if humdrum:
-                    humdrum_string[-1] = humdrum_string[-1][0] + ':' + humdrum_string[-1][1:]
-                    continue
+                    state.humdrum_lines.append(bytearray(_CLEFS_HUMDRUM[initial_clef['pitch']], 'ascii'))
 
-            if t in RESTS_MEI.keys():
-                rest = etree.SubElement(xml_layer, 'rest')
-                rest.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'rest-{ids[increment_idcounter()]}')
-                rest.set('dur', RESTS_MEI[t])
+                if initial_flat_found:
+                    state.xml_keySign.set(_XMLID, _new_id('keySig'))
+                    state.xml_keySign.set('sig', '1f')
+                    initial_key = 'flat'
 
-                if humdrum:
-                    humdrum_line = RESTS_HUMDRUM[t]
-
-            if t in NOTES_MEI.keys():
-                oct, pname = analyse_note(clef, symbol['pitch'])
-                note = etree.SubElement(xml_layer, 'note')
-                note.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'note-{ids[increment_idcounter()]}')
-                note.set('dur', NOTES_MEI[t])
-                note.set('oct', str(oct))
-                note.set('pname', pname)
-
-                if humdrum and not ligature:
-                    line_humdrum = NOTES_HUMDRUM[t]
-                
-                if t == 'br' or t == 'sb':
-                    note.set('colored', 'true')
                     if humdrum:
-                        line_humdrum = NOTES_HUMDRUM[t]
-
-                if humdrum:
-                    line_humdrum = get_humdrum_pitch(oct, pname, line_humdrum)
-
-                if t == 'li':
-                    xml_lig = etree.SubElement(xml_layer, 'ligature')
-                    xml_lig.set('{http://www.w3.org/XML/1998/namespace}id',
-                                f'ligature-{ids[increment_idcounter()]}')
-                    xml_lig.set('form', 'recta')
-                    xml_lig.append(note)
-                    ligature = True
-                    if humdrum:
-                        line_humdrum = '[s'
-                        line_humdrum = get_humdrum_pitch(oct, pname, line_humdrum)
-                        humdrum_string.append(line_humdrum)
+                        state.humdrum_lines.append(bytearray(b'*k[b-]'))
+        
+            state.sharp_found = False
+            state.flat_found = False
+            state.ligature = False
+            for ix_symbol, symbol in enumerate(staff):
+                t = symbol['type']
+                if symbol == initial_clef:
+                    state.clef = initial_clef
                     continue
 
-                if ligature:
-                    note.attrib['dur'] = 'semibrevis'
-                    xml_lig.append(note)
-                    ligature = False
-                    if humdrum:
-                        line_humdrum = 's'
-                        line_humdrum = get_humdrum_pitch(oct, pname, line_humdrum)
-                        line_humdrum += ']'
-                        humdrum_line = line_humdrum
-
-                if sharp_found:
-                    note.set('accid', 's')
-                    sharp_found = False
-                    if humdrum:
-                        line_humdrum += '#'
-
-                if flat_found:
-                    note.set('accid', 'f')
-                    flat_found = False
-                    if humdrum:
-                        line_humdrum += '-'
-                        
-                if humdrum:
-                    humdrum_line = line_humdrum     
-
-            if t == 'bar':
-                barline = etree.SubElement(xml_layer, 'barLine')
-                barline.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'barline-{ids[increment_idcounter()]}')
-                barline.set('form', 'dbl')
-
-                if humdrum:
-                    humdrum_string.append('=||')
-                    humdrum_string.append('*-')
-
-                filename, filename_counter = save_mei_file(metadata, filename_counter, ix_staff, mei, filename, stafflist, humdrum_string,
-                                                           humdrum)
-
-                del mei
+                if t == initial_key and ix_symbol == 1:
+                    continue
 
-                mei = etree.Element('mei')
-                mei.set('xmlns', 'http://www.music-encoding.org/ns/mei')
-                mei.set('meiversion', '5.0')
+                if t == initial_key and ix_symbol == 2:
+                    if state.clef['pitch'] == 'c-c-g':
+                        continue
 
-                mei.append(create_meihead())
+                get_handler(t, handle_other)(state, symbol, ix_symbol, staff)
 
-                xml_clef, xml_keySign, xml_layer = create_mei_declarations(ids, mei)
+            if not state.saved:
+                if ix_staff != len(stafflist) - 1:
+                    _sub(state.xml_layer, 'barLine', 'barline', visible='false')
 
-                first_staff = True
-                saved = True
-                continue
+        if not state.saved:
+            save_mei_file(metadata, state.filename_counter, ix_staff, state.mei, state.filename, stafflist,
+                          state.humdrum_lines, humdrum)
+    except BaseException:
+        # the pieces saved before the error are still written, a failing write must not hide the error
+        try:
+            flush_pending_writes(mei_dir, humdrum_dir)
+        except Exception as error:
+            cprint(f'Could not write the saved pieces: {error}', 'red')
+        raise
 
-            if t == 'custos':
-                custos = etree.SubElement(xml_layer, 'custos')
-                custos.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'custos-{ids[increment_idcounter()]}')
-                if humdrum:
-                    line_humdrum = '*custos'
-
-                if ix_staff < len(stafflist) - 1:
-                    for symbol in stafflist[ix_staff + 1]:
-                        if symbol['type'] in NOTES_MEI.keys():
-                            oct, pname = analyse_note(clef, symbol['pitch'])
-                            custos.set('oct', str(oct))
-                            custos.set('pname', pname)
-                            if humdrum:
-                                
-                                humdrum_line = get_humdrum_pitch(oct, pname, line_humdrum)
-                            break
-            if humdrum:
-                humdrum_string.append(humdrum_line)
-
-                if 'custos' in humdrum_line:
-                    humdrum_string.append('!!LO:LB:g=z')
-                    humdrum_string.append('=-')
-
-        if not saved:                        
-            if ix_staff != len(stafflist) - 1:
-                barline = etree.SubElement(xml_layer, 'barLine')
-                barline.set('{http://www.w3.org/XML/1998/namespace}id',
-                            f'barline-{ids[increment_idcounter()]}')
-                barline.set('visible', 'false')
-
-    if not saved:
-        save_mei_file(metadata, filename_counter, ix_staff, mei, filename, stafflist, humdrum_string, humdrum)
+    flush_pending_writes(mei_dir, humdrum_dir)
                 
         
     cprint('Conversion complete!', 'green')
 
 def get_humdrum_pitch(oct: int, pname: str, line: str) -> str:
     """ converts mei pitch to humdrum pitch """
-    if oct == 2:
-        line += pname.upper() + pname.upper()
-    elif oct == 3:
-        line += pname.upper()
-    elif oct == 4:
-        line += pname
-    elif oct == 5:
-        line += pname + pname
-
-    return line
+    return line + _HUMDRUM_PITCH_SUFFIX.get((oct, pname), '')
 
 def save_mei_file(metadata: list,
                   filename_counter: int,
@@ -466,10 +601,14 @@ def save_mei_file(metadata: list,
                   mei: etree.Element,
                   filename: str,
                   stafflist: list,
-                  humdrum_string: list,
+                  humdrum_lines: list,
                   humdrum: bool) -> tuple:
     """
-    Save the MEI file and optionally a Humdrum file.
+    Queue the MEI file and optionally a Humdrum file for saving.
+
+    The files are written to disk by flush_pending_writes once
+    `config.BATCH_SIZE` pieces are queued and at the end of the
+    conversion.
 
     Parameters
     ----------
@@ -485,8 +624,8 @@ def save_mei_file(metadata: list,
         The current filename.
     stafflist : list
         List of staffs in the MEI files.
-    humdrum_string : list
-        List of strings representing the Humdrum content.
+    humdrum_lines : list
+        List of bytearrays representing the lines of the Humdrum content.
     humdrum : bool
         Flag indicating whether to save a Humdrum file.
 
@@ -501,7 +640,7 @@ def save_mei_file(metadata: list,
     if filename not in used_filenames:
         save_name = f'{metadata[ix_staff]}_01.mei'
         filename_counter = 1
-        used_filenames.append(filename)
+        used_filenames.add(filename)
     else:
         filename_counter += 1
         save_name = f'{filename}_{str(filename_counter).zfill(2)}.mei'
@@ -510,28 +649,63 @@ def save_mei_file(metadata: list,
     if ix_staff != len(stafflist) - 1:
         filename = metadata[ix_staff + 1]
 
-    tree = etree.ElementTree(mei)
-    xml_content = etree.tostring(tree, pretty_print=True)
-
-    with open(os.path.join("mei_output", save_name), 'wb') as f:
-        f.write(xml_content)
-
+    humdrum_content = None
     if humdrum:
-        with open(os.path.join("humdrum_output", f'{save_name[:-3]}.mens'), 'w') as f:
-            f.write('\n'.join(humdrum_string))
+        # the humdrum buffer keeps growing, so take a snapshot now
+        humdrum_content = b'\n'.join(humdrum_lines).decode('ascii')
+
+    # the files are written in batches by flush_pending_writes, so only a bounded number of pieces is kept in memory
+    _PENDING_WRITES.append((save_name, mei, humdrum_content))
+    if len(_PENDING_WRITES) >= config.BATCH_SIZE:
+        flush_pending_writes(config.OUTPUT_FOLDERS['mei_output'], config.OUTPUT_FOLDERS['humdrum_output'])
 
     return filename, filename_counter
 
 
-def create_mei_declarations(ids: list, mei: etree.Element) -> tuple:
+def _write_one(pending_write: tuple, mei_dir: str, humdrum_dir: str) -> None:
+    """ writes one queued MEI file and its optional Humdrum file """
+    save_name, mei, humdrum_content = pending_write
+
+    # stream the serialized tree to disk instead of building the whole document in memory
+    with etree.xmlfile(f'{mei_dir}/{save_name}', encoding='utf-8') as xf:
+        xf.write_declaration()
+        # indented output is only needed for inspection while debugging
+        xf.write(mei, pretty_print=config.DEBUG_MODE)
+
+    if humdrum_content is not None:
+        with open(f'{humdrum_dir}/{save_name[:-3]}.mens', 'w') as f:
+            f.write(humdrum_content)
+
+
+def flush_pending_writes(mei_dir: str, humdrum_dir: str) -> None:
+    """
+    Write all files queued by save_mei_file.
+
+    Serialization and disk writes are I/O-bound, so the files are
+    written concurrently by a small thread pool.
+
+    Parameters
+    ----------
+    mei_dir : str
+        Existing folder for the MEI files.
+    humdrum_dir : str
+        Existing folder for the Humdrum files.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+            list(executor.map(_write_one, _PENDING_WRITES,
+                              itertools.repeat(mei_dir), itertools.repeat(humdrum_dir)))
+    finally:
+        _PENDING_WRITES.clear()
+
+
+def create_mei_declarations(mei: etree.Element) -> tuple:
     """
     Create MEI declarations and return the clef, key signature,
     and layer elements.
 
     Parameters
     ----------
-    ids : list
-        List of IDs to be used for the XML elements.
     mei : lxml.etree.Element
         The root MEI element.
 
@@ -541,45 +715,14 @@ def create_mei_declarations(ids: list, mei: etree.Element) -> tuple:
         The clef, key signature, and layer XML elements.
 
     """
-    music = etree.SubElement(mei, 'music')
-    body = etree.SubElement(music, 'body')
-    mdiv = etree.SubElement(body, 'mdiv')
-    mdiv.set('{http://www.w3.org/XML/1998/namespace}id',
-                 f'mdiv-{ids[increment_idcounter()]}')
-
-    score = etree.SubElement(mdiv, 'score')
-    score.set('{http://www.w3.org/XML/1998/namespace}id',
-                  f'score-{ids[increment_idcounter()]}')
-
-    scoreDef = etree.SubElement(score, 'scoreDef')
-    scoreDef.set('{http://www.w3.org/XML/1998/namespace}id',
-                     f'scoreDef-{ids[increment_idcounter()]}')
-    staffGrp = etree.SubElement(scoreDef, 'staffGrp')
-    staffGrp.set('{http://www.w3.org/XML/1998/namespace}id',
-                     f'staffGrp-{ids[increment_idcounter()]}')
-    staffDef = etree.SubElement(staffGrp, 'staffDef')
-    staffDef.set('{http://www.w3.org/XML/1998/namespace}id',
-                     f'staffDef-{ids[increment_idcounter()]}')
-    staffDef.set('n', '1')
-    staffDef.set('notationtype', 'mensural.white')
-    staffDef.set('lines', '5')
-    xml_clef = etree.SubElement(staffDef, 'clef')
-    xml_keySign = etree.SubElement(staffDef, 'keySig')
-
-    section = etree.SubElement(score, 'section')
-    section.set('{http://www.w3.org/XML/1998/namespace}id',
-                    f'section-{ids[increment_idcounter()]}')
-        
-    xml_staff = etree.SubElement(section, 'staff')
-    xml_staff.set('{http://www.w3.org/XML/1998/namespace}id',
-                        f'staff-{ids[increment_idcounter()]}')
-    xml_staff.set('n', '1')
+    nodes = {'mei': mei}
+    for tag, parent in _DECL_SCHEMA:
+        if tag in _DECL_WITH_ID:
+            nodes[tag] = _sub(nodes[parent], tag, tag, **_STATIC_ATTRS.get(tag, {}))
+        else:
+            nodes[tag] = etree.SubElement(nodes[parent], tag)
 
-    xml_layer = etree.SubElement(xml_staff, 'layer')
-    xml_layer.set('{http://www.w3.org/XML/1998/namespace}id',
-                        f'layer-{ids[increment_idcounter()]}')
-    xml_layer.set('n', '1')
-    return xml_clef, xml_keySign, xml_layer
+    return nodes['clef'], nodes['keySig'], nodes['layer']
 
 
 def create_meihead():
@@ -604,9 +747,8 @@ def create_meihead():
 
     encodingDesc = etree.SubElement(meihead, 'encodingDesc')
     appInfo = etree.SubElement(encodingDesc, 'appInfo')
-    application = etree.SubElement(appInfo, 'application')
-    application.set('isodate', datetime.now().isoformat())
-    application.set('version', VERSION)
+    application = etree.SubElement(appInfo, 'application',
+                                   attrib={'isodate': datetime.now().isoformat(), 'version': VERSION})
     name = etree.SubElement(application, 'name')
     name.text = 'mensural_to_mei'
 
@@ -634,30 +776,7 @@ def analyse_clef(clef: dict) -> tuple:
         The shape and line of the clef.
 
     """
-    p = clef['pitch']
-    if p == 'c-g':
-        shape = 'G'
-        line = '2'
-    elif p == 'c-c-e':
-        shape = 'C'
-        line = '1'
-    elif p == 'c-c-g':
-        shape = 'C'
-        line = '2'
-    elif p == 'c-c-b':
-        shape = 'C'
-        line = '3'
-    elif p == 'c-c-d':
-        shape = 'C'
-        line = '4'
-    elif p == 'c-f-b':
-        shape = 'F'
-        line = '3'
-    elif p == 'c-f':
-        shape = 'F'
-        line = '4'
-
-    return shape, line
+    return _CLEF_SHAPE_LINE[clef['pitch']]
 
 
 def analyse_mensuration(symbol: dict) -> tuple:
@@ -679,18 +798,7 @@ def analyse_mensuration(symbol: dict) -> tuple:
         The sign and slash of the mensuration.
 
     """
-    p = symbol['pitch']
-    if p == 'met_c':
-        sign = 'C'
-        slash = ''
-    elif p == 'al-br':
-        sign = 'C'
-        slash = '1'
-    elif p == 'met_o_cut':
-        sign = 'O'
-        slash = '1'
-
-    return sign, slash
+    return _MENSUR_TABLE[symbol['pitch']]
  
 
 def analyse_note(clef: dict, pitch: str) -> tuple:
@@ -714,64 +822,19 @@ def analyse_note(clef: dict, pitch: str) -> tuple:
         The octave and relative pitch of the note.
 
     """
-    c = clef['pitch']
-
-    # Define a dictionary to map mensural note steps to integers
-    MENSURAL_NOTE_STEPS = {'c0': 0, 'd0': 1, 'e0': 2, 'f0': 3, 'g0': 4, 'a0': 5, 'b0': 6,
-                           'c1': 7, 'd1': 8, 'e1': 9, 'f1': 10, 'g1': 11, 'a1': 12, 'b1': 13,
-                           'c2': 14, 'd2': 15, 'e2': 16, 'f2': 17, 'g2': 18, 'a2': 19, 'b2': 20
-                           }
-    
-    # Define a dictionary to map relative note steps to note names
-    RELATIVE_NOTE_STEPS = {
-            -14: 'c', -13: 'd', -12: 'e', -11: 'f', -10: 'g', -9: 'a', -8: 'b',
-            -7: 'c', -6: 'd', -5: 'e', -4: 'f', -3: 'g', -2: 'a', -1: 'b',
-            0: 'c', 1: 'd', 2: 'e', 3: 'f', 4: 'g', 5: 'a', 6: 'b',
-            7: 'c', 8: 'd', 9: 'e', 10: 'f', 11: 'g', 12: 'a', 13: 'b'
-        }
-    
-    # Set the initial octave
-    octave = 4
-
     # Determine the clef line based on the 'pitch' of the clef
-    if c == 'c-c-g':
-        clefline = MENSURAL_NOTE_STEPS['g1']
-    elif c == 'c-c-e':
-        clefline = MENSURAL_NOTE_STEPS['e1']
-    elif c == 'c-c-b':
-        clefline = MENSURAL_NOTE_STEPS['b1']
-    elif c == 'c-c-d':
-        clefline = MENSURAL_NOTE_STEPS['d2']
-    elif c == 'c-g':
-        clefline = MENSURAL_NOTE_STEPS['c1']
-    elif c == 'c-f-b':
-        clefline = MENSURAL_NOTE_STEPS['f2']
-    elif c == 'c-f':
-        clefline = MENSURAL_NOTE_STEPS['a2']
+    clefline = _CLEF_TO_CLEFLINE[clef['pitch']]
 
     # Determine the pitch line based on the pitch
-    pitchline = MENSURAL_NOTE_STEPS[pitch]
+    pitchline = _MENSURAL_NOTE_STEPS[pitch]
 
-    # Calculate the relative pitch
-    rel_pitch = pitchline - clefline
-
-    # Adjust the octave and relative pitch based on the relative pitch
-    if -7 <= rel_pitch < 0:
-        octave -= 1
-        relative_pitch = RELATIVE_NOTE_STEPS[7 + rel_pitch]
-    elif rel_pitch > 6:
-        octave += 1
-        relative_pitch = RELATIVE_NOTE_STEPS[rel_pitch]
-    elif -14 <= rel_pitch < -7:
-        octave -= 2
-        relative_pitch = RELATIVE_NOTE_STEPS[7 + rel_pitch]
-    else:
-        relative_pitch = RELATIVE_NOTE_STEPS[rel_pitch]
+    # Look up the octave shift and note name of the relative pitch
+    octave_delta, relative_pitch = _REL_PITCH_TABLE[pitchline - clefline]
+    octave = 4 + octave_delta
 
     return octave, relative_pitch
 
 if __name__ == "__main__":
-    with open("symbols_and_pitches.pkl", "rb") as f:
-        saved_data = pickle.load(f)
+    saved_data = load_pickle("symbols_and_pitches.pkl")
 
     convert_to_mei_and_humdrum(saved_data)
\ No newline at end of file
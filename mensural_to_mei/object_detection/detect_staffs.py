@@ -35,15 +35,14 @@ Note:
     are installed before running the script.
 """
 
-import math
 import numpy as np
-import onnxruntime as ort
 from mensural_to_mei.configs import config
 from mensural_to_mei.object_detection.do_inference import do_inference
+from mensural_to_mei.object_detection.onnx_sessions import get_session
 from mensural_to_mei.preprocess_images.preprocess_images import process_image
 from mensural_to_mei.utils import do_onnx_analysis
 
-def detect_staffs(image: np.ndarray) -> list[tuple]:
+def detect_staffs(image: np.ndarray, denoise: bool = True) -> list[tuple]:
     """
     Detects staff lines in a musical notation image using a pre-trained ONNX model.
 
@@ -51,6 +50,10 @@ def detect_staffs(image: np.ndarray) -> list[tuple]:
     ----------
     image : np.ndarray
         The input image as a numpy array.
+    denoise : bool, optional
+        Whether to remove noise from the image before the detection. Set it
+        to False for images already preprocessed by `process_image`. The
+        default is True.
 
     Returns
     -------
@@ -74,15 +77,13 @@ def detect_staffs(image: np.ndarray) -> list[tuple]:
     onnx_model_path = config.MODEL_PATHES['staffs']
 
     fullpage_image, padding, resize_factor = process_image(image, (config.IMAGE_SIZE[0], config.IMAGE_SIZE[1]),
-                                                           rescale=True)
+                                                           rescale=True, denoise=denoise)
     
-    session = ort.InferenceSession(onnx_model_path,
-                                #    providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-                                   )
+    # the staff model always runs on a single page
+    session = get_session(onnx_model_path, batch_size=1)
 
-    img = fullpage_image.astype(np.float32)
-
-    output = do_inference(session, img)
+    # do_inference converts the image to float32 while filling the model input
+    output = do_inference(session, fullpage_image)
     
     staffs, _ = do_onnx_analysis(output)    # labels not needed
 
@@ -92,13 +93,13 @@ def detect_staffs(image: np.ndarray) -> list[tuple]:
     security_range = 20
 
     # recalculate detected coordinates to original dimensions
-    for staff in staffs:
-        staff[0] = max(0, math.floor((staff[0] - offset_x) / resize_factor))
-        staff[1] = max(0, math.floor((staff[1] - offset_y - security_range) / resize_factor))
-        staff[2] = min(image.shape[1], math.floor((staff[2] - offset_x) / resize_factor))
-        staff[3] = min(image.shape[0], math.floor((staff[3] - offset_y + security_range) / resize_factor))
+    boxes = np.asarray(staffs, dtype=np.float64).reshape(-1, 4)
+    boxes -= (offset_x, offset_y + security_range, offset_x, offset_y - security_range)
+    boxes = np.floor(boxes / resize_factor).astype(int)
+    np.maximum(boxes[:, :2], 0, out=boxes[:, :2])
+    np.minimum(boxes[:, 2:], (image.shape[1], image.shape[0]), out=boxes[:, 2:])
 
     # sort staffs in ascending order by ymin-coordinate to get staffs in correct order
-    sorted_staffs = sorted(staffs, key=lambda box: box[1])
+    sorted_staffs = boxes[np.argsort(boxes[:, 1], kind='stable')].tolist()
 
     return sorted_staffs
\ No newline at end of file
@@ -10,9 +10,9 @@ The script imports necessary modules and functions from `math`, `os`,
 The `detect_symbols` function uses the ONNX model located at 
 "models/object_detection/best_symbols.onnx" for inference. It processes 
 each staff in the input list, resizes the staff image, performs 
-inference, and analyzes the output to detect symbols. The detected 
-symbols are then sorted and appended to the `staff_symbols` list which 
-is returned by the function.
+batched inference over all staffs of the image, and analyzes the 
+output to detect symbols. The detected symbols are then sorted and 
+appended to the `staff_symbols` list which is returned by the function.
 
 Please refer to the docstring of the `detect_symbols` function for more 
 details about its parameters and return value.
@@ -21,12 +21,11 @@ details about its parameters and return value.
 import math
 import cv2
 import numpy as np
-import onnxruntime as ort
-from tqdm import tqdm
 
 from mensural_to_mei.configs import config
-from mensural_to_mei.object_detection.do_inference import do_inference
-from mensural_to_mei.preprocess_images.preprocess_images import calc_new_dimensions
+from mensural_to_mei.object_detection.do_inference import do_batch_inference
+from mensural_to_mei.object_detection.onnx_sessions import get_session
+from mensural_to_mei.preprocess_images.preprocess_images import calc_new_dimensions, get_interpolation, pad_to_canvas
 from mensural_to_mei.utils import do_onnx_analysis
 
 
@@ -49,9 +48,9 @@ def detect_symbols(
         of four integers [x1, y1, x2, y2] representing the coordinates of 
         the bounding box of the staff in the image.
     image : np.ndarray
-        The image in which to detect symbols. The image is a numpy array 
-        of shape (H, W, 3), where H is the height of the image, W is the 
-        width of the image, and 3 represents the three color channels.
+        The preprocessed grayscale image in which to detect symbols. The 
+        image is a numpy array of shape (H, W), where H is the height of 
+        the image and W is the width of the image.
     classes : list
         List of classes for the symbols to be detected.
 
@@ -66,35 +65,43 @@ def detect_symbols(
     """
     onnx_model_path = config.MODEL_PATHES['symbols']
 
-    session = ort.InferenceSession(onnx_model_path,
-                                #    providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-                                   )
+    session = get_session(onnx_model_path)
 
-    staff_symbols = []
-    for staff in tqdm(staffs, desc='Detecting symbols'):
+    # prepare all staff images of the page in one canvas block to run the model once per batch
+    staff_images = np.empty((len(staffs), config.STAFF_SIZE[1], config.STAFF_SIZE[0]), dtype=np.uint8)
+    staff_transforms = []
+    for staff, staff_canvas in zip(staffs, staff_images):
         staff_image = image[staff[1]:staff[3], staff[0]:staff[2]]
 
         new_w, new_h, padding, resize_factor = calc_new_dimensions(staff_image, (config.STAFF_SIZE[0], config.STAFF_SIZE[1]))
 
-        resized_image = cv2.resize(staff_image, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
+        resized_image = cv2.resize(staff_image, (new_w, new_h), interpolation=get_interpolation(resize_factor))
+
+        pad_to_canvas(resized_image, padding, staff_canvas)
+
+        staff_transforms.append((padding, resize_factor))
 
-        staff_image = np.zeros((config.STAFF_SIZE[1], config.STAFF_SIZE[0], 3), dtype=np.uint8)
-        staff_image.fill(255)
-        staff_image[padding[0]:padding[1], padding[2]:padding[3]] = resized_image
-        
-        output = do_inference(session, staff_image)
+    outputs = do_batch_inference(session, staff_images, desc='Detecting symbols') if len(staffs) else []
+
+    staff_symbols = []
+    for staff, (padding, resize_factor), staff_output in zip(staffs, staff_transforms, outputs):
+        boxes, labels = do_onnx_analysis([staff_output])
 
-        boxes, labels = do_onnx_analysis(output)
+        known = [ix for ix, label in enumerate(labels) if label in classes]
 
-        symbol_list = [[box[0], box[1], box[2], box[3], classes[label]] for box, label in zip(boxes, labels) if label in classes]
+        # recalculate the x-coordinates to the original image, symbols span the full staff height
+        x_coords = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)[known][:, [0, 2]]
+        x_coords = np.floor((x_coords - padding[2]) / resize_factor + staff[0]).astype(int)
+        np.maximum(x_coords[:, 0], 0, out=x_coords[:, 0])
+        np.minimum(x_coords[:, 1], image.shape[1], out=x_coords[:, 1])
 
-        for symbol in symbol_list:
-            symbol[0] = max(0, math.floor((symbol[0] - padding[2]) / resize_factor + staff[0]))
-            symbol[1] = max(0, math.floor(staff[1]))
-            symbol[2] = min(image.shape[1], math.floor((symbol[2] - padding[2]) / resize_factor + staff[0]))
-            symbol[3] = min(image.shape[0], math.floor(staff[3]))
+        y_min = max(0, math.floor(staff[1]))
+        y_max = min(image.shape[0], math.floor(staff[3]))
 
-        sorted_symbols = sorted(symbol_list, key=lambda box: box[0])
+        # sort the symbols in ascending order by xmin-coordinate
+        order = np.argsort(x_coords[:, 0], kind='stable')
+        sorted_symbols = [[x_min, y_min, x_max, y_max, classes[labels[known[ix]]]]
+                          for (x_min, x_max), ix in zip(x_coords[order].tolist(), order.tolist())]
 
         staff_symbols.append(sorted_symbols)
     
@@ -8,11 +8,18 @@ preprocessed images.
 
 The main function, `do_detection`, accepts a list of image file paths
 and returns a dictionary mapping each image file name to its detected
-musical symbols. The script employs several utility functions from the
-`mensural_to_mei` package for image preprocessing, staff detection, and
-symbol detection.
+musical symbols, while `detect_pages` yields the pages one at a time
+together with their preprocessed images. The script employs several
+utility functions from the `mensural_to_mei` package for image
+preprocessing, staff detection, and symbol detection.
 
 Functions:
+    load_image(image_path): Reads and preprocesses an image for the
+        detection.
+    load_detection_models(): Creates the inference sessions of the staff
+        and symbol detection models in advance.
+    detect_pages(list_of_images): Detects musical symbols page by page,
+        yielding the results together with the preprocessed images.
     do_detection(list_of_images): Processes a list of images and detects
         musical symbols, returning a dictionary of results.
 
@@ -44,11 +51,16 @@ Note:
 
 import os
 import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+import numpy as np
 from mensural_to_mei.configs import config
 from mensural_to_mei.preprocess_images.preprocess_images import process_image
 from mensural_to_mei.object_detection.detect_staffs import detect_staffs
 from mensural_to_mei.object_detection.detect_symbols import detect_symbols
+from mensural_to_mei.object_detection.onnx_sessions import get_session
 from mensural_to_mei.utils import count_elements, load_yaml
 from colorama import just_fix_windows_console
 from termcolor import cprint
@@ -56,57 +68,103 @@ from termcolor import cprint
 just_fix_windows_console()
 
 
-def do_detection(list_of_images: list) -> dict:
+def load_image(image_path: str) -> np.ndarray:
+    """ reads an image and denoises it once for staff and symbol detection """
+    # decode directly to grayscale, process_image skips the color conversion for it
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    grayscale_image, _, _ = process_image(image, (0, 0), rescale=False)
+    return grayscale_image
+
+
+def load_detection_models() -> None:
+    """ creates the sessions used by detect_staffs and detect_symbols before the first image """
+    get_session(config.MODEL_PATHES['staffs'], batch_size=1)
+    get_session(config.MODEL_PATHES['symbols'])
+
+
+def detect_pages(list_of_images: list) -> Iterator[tuple[str, list, np.ndarray]]:
     """
-    Detect musical symbols in a list of images.
+    Detect musical symbols in a list of images, one page at a time.
 
-    This method processes each image in the provided list to detect
-    musical symbols using object detection models. It outputs a
-    dictionary mapping each image filename to the detected symbols.
+    The pages are yielded as soon as their symbols are detected, together
+    with their preprocessed image. The caller can classify the pitches of
+    a page and release its image before the next page is processed, so
+    only a few page images are held in memory at a time.
 
     Parameters
     ----------
     list_of_images : list
         A list of file paths to the images that will be processed.
 
-    Returns
-    -------
-    dict
-        A dictionary where each key is the filename of an image (without
-        the file extension) and each value is the list of detected
-        symbols for that image.
+    Yields
+    ------
+    tuple
+        - filename: The filename of the image without the file extension.
+        - file_symbols: The list of detected symbols for that image.
+        - grayscale_image: The preprocessed image, which is reused for
+          the pitch classification.
 
     Notes
     -----
     The method utilizes pre-trained models defined in 'best_symbols.yaml'
     for object detection and 'configs.yaml' for program configurations.
     It also prints the processing status and results to the console.
+
+    The next `config.PREFETCH_IMAGES` images are read and preprocessed in
+    background threads while the models run on the current image.
     """
 
     SYMBOL_CLASSES = load_yaml(config.LABEL_PATHES['symbols'])
 
-    all_found_symbols = {}
-    for image_path in list_of_images:
-        filename = os.path.splitext(os.path.basename(image_path))[0]
-        cprint(f"Processing {filename}", "blue")
-        start = time.time()
+    prefetch = max(1, config.PREFETCH_IMAGES)
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        # images loading in the background, in the order of list_of_images
+        next_images = deque(executor.submit(load_image, path) for path in list_of_images[:prefetch])
+
+        for ix_image, image_path in enumerate(list_of_images):
+            filename = os.path.splitext(os.path.basename(image_path))[0]
+            cprint(f"Processing {filename}", "blue")
+            start = time.time()
 
-        image = cv2.imread(image_path)
-        cprint('detecting staffs', 'blue')
-        staffs = detect_staffs(image)
+            grayscale_image = next_images.popleft().result()
 
-        grayscale_image, _, _ = process_image(image, (0, 0), rescale=False)
+            # preprocess the following images while the models run on this one
+            if ix_image + prefetch < len(list_of_images):
+                next_images.append(executor.submit(load_image, list_of_images[ix_image + prefetch]))
 
-        temp_path = os.path.join(config.OUTPUT_FOLDERS['preprocessed_images'], f"{filename}.jpg")
+            # the page is already denoised, staff detection only rescales it
+            cprint('detecting staffs', 'blue')
+            staffs = detect_staffs(grayscale_image, denoise=False)
 
-        cv2.imwrite(temp_path, grayscale_image)
+            file_symbols = detect_symbols(staffs, grayscale_image, SYMBOL_CLASSES)
+            number_of_staffs = len(file_symbols)
+            number_of_symbols = count_elements(file_symbols)
 
-        file_symbols = detect_symbols(staffs, grayscale_image, SYMBOL_CLASSES)
-        number_of_staffs = len(file_symbols)
-        number_of_symbols = count_elements(file_symbols)
+            end = time.time()
+            cprint(f"Found {number_of_symbols} symbols in {number_of_staffs} staffs in {end - start} seconds", "green")
+            yield filename, file_symbols, grayscale_image
 
-        end = time.time()
-        cprint(f"Found {number_of_symbols} symbols in {number_of_staffs} staffs in {end - start} seconds", "green")
-        all_found_symbols[filename] = file_symbols
 
-    return all_found_symbols
\ No newline at end of file
+def do_detection(list_of_images: list) -> dict:
+    """
+    Detect musical symbols in a list of images.
+
+    This method processes each image in the provided list to detect
+    musical symbols using object detection models. It outputs a
+    dictionary mapping each image filename to the detected symbols.
+    The preprocessed images are released after each page, use
+    `detect_pages` to process them further.
+
+    Parameters
+    ----------
+    list_of_images : list
+        A list of file paths to the images that will be processed.
+
+    Returns
+    -------
+    dict
+        A dictionary where each key is the filename of an image (without
+        the file extension) and each value is the list of detected
+        symbols for that image.
+    """
+    return {filename: file_symbols for filename, file_symbols, _ in detect_pages(list_of_images)}
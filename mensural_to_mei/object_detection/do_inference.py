@@ -1,4 +1,74 @@
+import threading
+
 import numpy as np
+import onnxruntime as ort
+from tqdm import tqdm
+from mensural_to_mei.configs import config
+
+# per-thread input buffers and IO bindings, keyed by session and image shape
+_BINDINGS = threading.local()
+
+
+def _get_binding(session, shape: tuple) -> tuple:
+    """ returns the input buffer for a batch of the given shape and the IO binding it is bound to """
+    bindings = getattr(_BINDINGS, 'bindings', None)
+    if bindings is None:
+        bindings = _BINDINGS.bindings = {}
+
+    batch_size = shape[0]
+    key = (id(session), shape[1:])
+    binding = bindings.get(key)
+    # one buffer per session and image shape, it only grows when a larger batch is needed
+    if binding is None or len(binding['buffer']) < batch_size:
+        binding = bindings[key] = {
+            'buffer': np.empty(shape, dtype=np.float32),
+            'io_binding': session.io_binding(),
+            'batch_size': None
+        }
+
+    input_buffer = binding['buffer'][:batch_size]
+    if binding['batch_size'] != batch_size:
+        io_binding = binding['io_binding']
+        # the OrtValue shares the memory of the buffer, so writing the buffer updates the input.
+        # Smaller batches are bound to the leading, contiguous part of the buffer.
+        io_binding.bind_ortvalue_input(session.get_inputs()[0].name, ort.OrtValue.ortvalue_from_numpy(input_buffer))
+
+        # outputs keep the shape of their last run, they are allocated again for the new batch size
+        io_binding.clear_binding_outputs()
+        for model_output in session.get_outputs():
+            io_binding.bind_output(model_output.name)
+
+        binding['batch_size'] = batch_size
+
+    return input_buffer, binding['io_binding']
+
+
+def _input_shape(session, image: np.ndarray, batch_size: int) -> tuple:
+    """ returns the (N, C, H, W) input shape for a batch of images like the given one """
+    height, width = image.shape[:2]
+    if image.ndim == 3:
+        return (batch_size, image.shape[2], height, width)
+
+    # single-channel images are fed to all input channels of the model, 3 if not fixed in the model
+    channels = session.get_inputs()[0].shape[1]
+    return (batch_size, channels if isinstance(channels, int) else 3, height, width)
+
+
+def _write_input(image: np.ndarray, buffer_slot: np.ndarray) -> None:
+    """ writes an image as normalized (C, H, W) float32 into its slot of the input buffer """
+    if image.ndim == 3:
+        # transpose from (H, W, C) to (C, H, W)
+        image = np.transpose(image, [2, 0, 1])
+
+    # convert to float32 and normalize the pixel values to the range [0, 1] in a single pass,
+    # a single-channel image is broadcast to all channels without an intermediate copy
+    np.divide(image, 255.0, out=buffer_slot, dtype=np.float32)
+
+
+def _run_binding(session, io_binding) -> list:
+    """ runs the session on its bound input and returns the outputs as numpy arrays """
+    session.run_with_iobinding(io_binding)
+    return io_binding.copy_outputs_to_cpu()
 
 
 def do_inference(session, staff_image: np.ndarray) -> np.ndarray: # type: ignore
@@ -15,9 +85,10 @@ def do_inference(session, staff_image: np.ndarray) -> np.ndarray: # type: ignore
         The ONNX InferenceSession to use for performing inference.
     staff_image : np.ndarray
         The staff image on which to perform inference. The image is a 
-        numpy array of shape (H, W, 3), where H is the height of the 
-        image, W is the width of the image, and 3 represents the three 
-        color channels.
+        numpy array of shape (H, W) for grayscale images or (H, W, 3), 
+        where H is the height of the image, W is the width of the image, 
+        and 3 represents the three color channels. Grayscale images are 
+        fed to every input channel of the model.
 
     Returns
     -------
@@ -25,23 +96,66 @@ def do_inference(session, staff_image: np.ndarray) -> np.ndarray: # type: ignore
         The output of the inference. The shape and contents of the output 
         depend on the ONNX model used for inference.
     """
-    model_inputs = session.get_inputs()
+    # The model expects a batch of (C, H, W) images as input
+    input_buffer, io_binding = _get_binding(session, _input_shape(session, staff_image, 1))
+
+    # Preprocess the staff image directly into the input buffer
+    _write_input(staff_image, input_buffer[0])
+
+    output = _run_binding(session, io_binding)
+
+    return output
+
+
+def do_batch_inference(session, images: list, batch_size: int = None, desc: str = None) -> np.ndarray:
+    """
+    Performs inference on a list of images using batched ONNX runs.
+
+    The images are preprocessed like in `do_inference` and stacked into
+    NCHW batches, so the model runs once per batch instead of once per
+    image.
+
+    Parameters
+    ----------
+    session : onnxruntime.InferenceSession
+        The ONNX InferenceSession to use for performing inference.
+    images : list or np.ndarray
+        List or array of images of identical shape, (H, W) or
+        (H, W, 3).
+    batch_size : int, optional
+        Maximum number of images per run. Defaults to
+        `config.BATCH_SIZE`. Models exported with a fixed batch
+        dimension are run one image at a time.
+    desc : str, optional
+        If given, a progress bar with this description is advanced by
+        the images of every batch.
+
+    Returns
+    -------
+    np.ndarray
+        The first model output of all images, concatenated along the
+        batch axis. Entry i belongs to images[i].
+    """
+    model_input = session.get_inputs()[0]
+
+    if batch_size is None:
+        batch_size = config.BATCH_SIZE
 
-    # Preprocess the staff image
-    # Convert the image data type to float32 for compatibility with the model
-    staff_image = staff_image.astype(np.float32)
+    # a fixed (integer) batch dimension means the model was exported without dynamic batch axis
+    if isinstance(model_input.shape[0], int):
+        batch_size = 1
 
-    # Normalize the image pixel values to the range [0, 1] by dividing by 255
-    staff_image = np.array(staff_image) / 255.0
+    outputs = []
+    with tqdm(total=len(images), desc=desc, disable=desc is None) as progress:
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            input_buffer, io_binding = _get_binding(session, _input_shape(session, batch[0], len(batch)))
 
-    # Transpose the image from (H, W, C) to (C, H, W)
-    # The model expects the color channels to be the first dimension
-    staff_image = np.transpose(staff_image, [2, 0, 1])
+            # write each image directly into the batch buffer
+            for image, buffer_slot in zip(batch, input_buffer):
+                _write_input(image, buffer_slot)
 
-    # Add an extra dimension to the image array to match the input shape expected by the model
-    # The model expects a batch of images as input
-    input_data = np.expand_dims(staff_image, axis=0)
+            outputs.append(_run_binding(session, io_binding)[0])
+            progress.update(len(batch))
 
-    output = session.run(None, {model_inputs[0].name: input_data})
-    
-    return output
\ No newline at end of file
+    return np.concatenate(outputs)
@@ -0,0 +1,131 @@
+"""
+Process-wide cache of ONNX Runtime inference sessions.
+
+Creating an `onnxruntime.InferenceSession` loads the model and optimizes
+its graph, which takes much longer than a single inference run. This
+module creates each session once per model path and shares it between
+all calls of the detection and classification functions.
+
+If `config.SAVE_OPTIMIZED_MODELS` is set, the optimized graph is written
+next to the model on the first build, so later program starts can load
+the already optimized model. The file name contains the execution
+provider and the ONNX Runtime version the graph was optimized for
+(`<model>.<provider>.ort<version>.opt.onnx`), and the file is only used
+while it is newer than the model, so a replaced model is optimized again.
+
+Models that always run with the same batch size can be loaded with a
+fixed batch dimension. The dynamic `batch` dimension of the model is
+then specialized once at load time, and the optimized graph is saved
+separately (`<model>.batch<n>.<provider>.ort<version>.opt.onnx`).
+
+Sessions run on the CUDA execution provider when onnxruntime-gpu finds a
+GPU and fall back to the CPU provider otherwise. All runs of a conversion
+are issued from one thread, so the graph runs sequentially and only the
+operators are parallelized, with `config.INTRA_OP_THREADS` threads.
+
+Functions:
+    get_session(model_path, batch_size): Returns the cached inference
+        session for a model, creating it on first use.
+
+Example:
+    >>> from mensural_to_mei.object_detection.onnx_sessions import get_session
+    >>> session = get_session(config.MODEL_PATHES['staffs'])
+    >>> output = do_inference(session, image)
+"""
+
+import os
+import threading
+
+import onnxruntime as ort
+
+from mensural_to_mei.configs import config
+
+_SESSIONS: dict[tuple, ort.InferenceSession] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+# preferred execution providers, CUDA is used if onnxruntime-gpu finds a GPU
+_PREFERRED_PROVIDERS = ("CUDAExecutionProvider", "CPUExecutionProvider")
+
+
+def _get_providers() -> list:
+    """ returns the preferred execution providers available in this installation """
+    available = ort.get_available_providers()
+    return [p for p in _PREFERRED_PROVIDERS if p in available]
+
+
+def _create_session(model_path: str, batch_size: int | None) -> ort.InferenceSession:
+    """ creates an inference session, reusing a saved optimized model if enabled and up to date """
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    # parallelize inside the operators only, one run at a time is issued
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.inter_op_num_threads = 1
+    if config.INTRA_OP_THREADS is not None:
+        sess_options.intra_op_num_threads = config.INTRA_OP_THREADS
+
+    model_root = os.path.splitext(model_path)[0]
+    if batch_size is not None:
+        # specialize the dynamic batch dimension, models without it are not affected
+        sess_options.add_free_dimension_override_by_name("batch", batch_size)
+        model_root = f"{model_root}.batch{batch_size}"
+
+    providers = _get_providers()
+    if not config.SAVE_OPTIMIZED_MODELS:
+        return ort.InferenceSession(model_path, sess_options, providers=providers)
+
+    # optimized graphs are specific to the execution provider and the ONNX Runtime version
+    provider_name = providers[0].replace("ExecutionProvider", "").lower()
+    optimized_path = f"{model_root}.{provider_name}.ort{ort.__version__}.opt.onnx"
+    if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path):
+        # the saved graph is already optimized, optimizing it again would cost most of the saved time
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return ort.InferenceSession(optimized_path, sess_options, providers=providers)
+
+    # serialize the optimized graph on the first build after the model changed. It is only kept if the
+    # session runs on the requested provider, a fallback to the CPU would save a CPU graph under its name.
+    temp_path = f"{optimized_path}.{os.getpid()}.tmp"
+    sess_options.optimized_model_filepath = temp_path
+    try:
+        session = ort.InferenceSession(model_path, sess_options, providers=providers)
+        if session.get_providers()[0] == providers[0]:
+            os.replace(temp_path, optimized_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return session
+
+
+def get_session(model_path: str, batch_size: int | None = None) -> ort.InferenceSession:
+    """
+    Returns the inference session for the given model.
+
+    The session is created on the first call for a model path and cached
+    for the lifetime of the process. Creation is guarded by a lock, so
+    concurrent callers share a single session per model.
+
+    Parameters
+    ----------
+    model_path : str
+        Path to the ONNX model.
+    batch_size : int, optional
+        Fixed batch size the model is always run with. The dynamic batch
+        dimension is then specialized when the session is created. By
+        default the batch dimension stays dynamic.
+
+    Returns
+    -------
+    onnxruntime.InferenceSession
+        The cached inference session.
+    """
+    key = (model_path, batch_size)
+    session = _SESSIONS.get(key)
+    if session is None:
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(key)
+            if session is None:
+                session = _create_session(model_path, batch_size)
+                _SESSIONS[key] = session
+
+    return session
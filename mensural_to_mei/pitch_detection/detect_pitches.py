@@ -3,8 +3,9 @@
 This script contains a function to detect pitches in musical symbols 
 using ONNX models.
 
-The `detect_pitches` function takes a list of detected symbols as input 
-and uses three different ONNX models to detect pitches in the symbols. 
+The `detect_pitches` function takes the detected symbols and the 
+preprocessed images as input and uses three different ONNX models to 
+detect pitches in the symbols. 
 The function returns a list of detected pitch for each symbol.
 
 The `detect_pitches` function uses the following ONNX models for pitch 
@@ -21,25 +22,55 @@ The function also uses the following yaml files for classes:
 Please refer to the docstring of the `detect_pitches` function for more 
 details about its parameters and return value.
 """
-import itertools
-import os
 import time
 
 import cv2
 import numpy as np
-import onnxruntime as ort
 from tqdm import tqdm
 
 from mensural_to_mei.configs import config
-from mensural_to_mei.object_detection.do_inference import do_inference
-from mensural_to_mei.preprocess_images.preprocess_images import calc_new_dimensions
+from mensural_to_mei.object_detection.do_inference import do_batch_inference
+from mensural_to_mei.object_detection.onnx_sessions import get_session
+from mensural_to_mei.preprocess_images.preprocess_images import calc_new_dimensions, get_interpolation, pad_to_canvas
 from mensural_to_mei.utils import load_program_folders, load_yaml
 from colorama import just_fix_windows_console
 from termcolor import cprint
 
 just_fix_windows_console()
 
-def detect_pitches(detected_symbols: list) -> list:
+
+def classify_batch(model_path: str, classes: dict, symbols: list, canvases: np.ndarray) -> None:
+    """
+    Classifies a batch of symbol images and stores the pitches.
+
+    Parameters
+    ----------
+    model_path : str
+        Path to the classifier model. Its session is created on the first
+        batch, so classifiers without symbols are never loaded.
+    classes : dict
+        The classes of the classifier.
+    symbols : list
+        Symbol dictionaries whose 'pitch' is set from the prediction.
+    canvases : np.ndarray
+        The reused image buffer of the classifier. The first len(symbols)
+        canvases hold the prepared images of the symbols.
+
+    Note
+    ----
+    The symbol list is emptied after classification, so the canvases can
+    be filled again.
+    """
+    if symbols:
+        session = get_session(model_path)
+        predictions = np.argmax(do_batch_inference(session, canvases[:len(symbols)]), axis=1)
+        for symbol, prediction in zip(symbols, predictions):
+            symbol['pitch'] = classes[int(prediction)]
+
+    symbols.clear()
+
+
+def detect_pitches(detected_symbols: dict, preprocessed_images: dict) -> dict:
     """
     Detects pitches in the given symbols using ONNX models.
 
@@ -49,9 +80,11 @@ def detect_pitches(detected_symbols: list) -> list:
 
     Parameters
     ----------
-    detected_symbols : list
-        List of detected symbols. Each symbol is represented as a 
-        dictionary with 'type' and 'pitch' keys.
+    detected_symbols : dict
+        Detected symbols per image, as yielded by `detect_pages`.
+    preprocessed_images : dict
+        Preprocessed images per image, as yielded by `detect_pages`.
+        The symbols are cropped from these images.
 
     Returns
     -------
@@ -68,23 +101,31 @@ def detect_pitches(detected_symbols: list) -> list:
     CLASSES_ALL_SYMBOLS = load_yaml(config.LABEL_PATHES['all_symbols'])
     CLASSES_MENS = load_yaml(config.LABEL_PATHES['mensuration'])
 
-    session_clef = ort.InferenceSession(config.MODEL_PATHES['clef'])
-    session_all_symbols = ort.InferenceSession(config.MODEL_PATHES['all_symbols'])
-    session_mens = ort.InferenceSession(config.MODEL_PATHES['mensuration'])
+    model_pathes = config.QUANTIZED_MODEL_PATHES if config.USE_QUANTIZED_CLASSIFIERS else config.MODEL_PATHES
 
     PITCH_DETECT_LIST = ['ma-u', 'ma-d', 'lo-u', 'lo-d', 'bre', 'sebre',
                          'mi-u', 'mi-d', 'sm-u', 'sm-d', 'fu-u', 'fu-d',
                          "sf-u", 'sf-d', 'br-min', 'sb-min', "li-lolu"]
-    CLASSIFICATION_LIST = PITCH_DETECT_LIST + ['clef', 'mens']
+
+    # symbols waiting for batched classification and the canvases holding their images, grouped by classifier.
+    # The canvases are allocated once and reused for every batch.
+    canvas_shape = (config.BATCH_SIZE, config.SYMBOL_SIZE[0], config.SYMBOL_SIZE[1])
+    pending = {
+        'all_symbols': (model_pathes['all_symbols'], CLASSES_ALL_SYMBOLS, [], np.empty(canvas_shape, dtype=np.uint8)),
+        'clef': (model_pathes['clef'], CLASSES_CLEF, [], np.empty(canvas_shape, dtype=np.uint8)),
+        'mens': (model_pathes['mensuration'], CLASSES_MENS, [], np.empty(canvas_shape, dtype=np.uint8)),
+    }
+
+    # classifier group of each symbol type to classify, found with a single lookup per symbol
+    classifier_groups = dict.fromkeys(PITCH_DETECT_LIST, pending['all_symbols'])
+    classifier_groups['clef'] = pending['clef']
+    classifier_groups['mens'] = pending['mens']
 
     symbol_pitch_list = {}
     for sourcefile, symbols in detected_symbols.items():
         cprint(f"Classify pitches in {sourcefile}", "blue")
         start = time.time()
-        flattened_list = list(itertools.chain.from_iterable(symbols))
-
-        preprocessed_path = os.path.join(config.OUTPUT_FOLDERS["preprocessed_images"], f"{sourcefile}.jpg")
-        grayscale_image = cv2.imread(preprocessed_path)
+        grayscale_image = preprocessed_images[sourcefile]
 
         staff_symbol_list = []
         classified_symbols = 0
@@ -94,56 +135,52 @@ def detect_pitches(detected_symbols: list) -> list:
                 pitch =''
                 note_type = roi[4]
 
-                # define short_type for symbols not in classification_list
+                # define short_type for symbols without classifier
                 # for classified notes the short_type will be changed after classification
                 short_type = note_type
 
-                if note_type in CLASSIFICATION_LIST:
+                symbol = {
+                    'type': short_type,
+                    'pitch': pitch
+                }
+
+                classifier_group = classifier_groups.get(note_type)
+                if classifier_group is not None:
                     classified_symbols += 1
                     # Extract the region of interest from the image
                     roi_image = grayscale_image[roi[1]:roi[3], roi[0]:roi[2]]
                     new_width, new_height, padding, resize_factor = calc_new_dimensions(
                         roi_image, (config.SYMBOL_SIZE[0], config.SYMBOL_SIZE[1])
                     )
-                    # Resize the region of interest (roi) image to the new dimensions using Lanczos resampling.
-                    # Lanczos resampling is a high-quality resampling method for digital images.
-                    resized_roi = cv2.resize(roi_image, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+                    # Resize the region of interest (roi) image to the new dimensions. Area interpolation is
+                    # used for shrinking, Lanczos resampling only for enlarging small symbols.
+                    resized_roi = cv2.resize(roi_image, (new_width, new_height), interpolation=get_interpolation(resize_factor))
 
-                    # Create a new image of shape (224, 224, 3) filled with zeros. The dtype is set to np.uint8 
-                    # because it's the standard for images, where each pixel is represented by an 8-bit (one byte) integer.
-                    processed_image = np.zeros((config.SYMBOL_SIZE[0], config.SYMBOL_SIZE[1], 3), dtype=np.uint8)
+                    # the pitch is filled in when the batch of the classifier is run
+                    model_path, classes, group_symbols, canvases = classifier_group
 
-                    # Fill the processed_image array with 255. In terms of images, 255 represents white when using 
-                    # an 8-bit grayscale image. So, this line effectively makes the entire image white.
-                    processed_image.fill(255)
+                    # Take the next free grayscale canvas of shape (224, 224) of the classifier.
+                    processed_image = canvases[len(group_symbols)]
 
-                    # Copy the resized region of interest to the center of the new image.
+                    # Copy the resized region of interest to the center of the canvas and fill the border
+                    # with 255, which represents white in an 8-bit grayscale image.
                     # The padding values are used to determine the location of the center of the image.
-                    processed_image[padding[0]:padding[1], padding[2]:padding[3]] = resized_roi
+                    pad_to_canvas(resized_roi, padding, processed_image)
 
+                    group_symbols.append(symbol)
+                    if len(group_symbols) == config.BATCH_SIZE:
+                        classify_batch(model_path, classes, group_symbols, canvases)
 
-                    if note_type in PITCH_DETECT_LIST:
-                        output = do_inference(session_all_symbols, processed_image)
-                        pitch = CLASSES_ALL_SYMBOLS[np.argmax(output[0])]
-                    elif note_type=='clef':
-                        output = do_inference(session_clef, processed_image)
-                        pitch = CLASSES_CLEF[np.argmax(output[0])]
-                    elif note_type=='mens':
-                        output = do_inference(session_mens, processed_image)
-                        pitch = CLASSES_MENS[np.argmax(output[0])]
-                    
-                    short_type = str.split(note_type, "-")[0]
+                    symbol['type'] = str.split(note_type, "-")[0]
 
-                symbol = {
-                    'type': short_type,
-                    'pitch': pitch
-                }
                 symbol_list.append(symbol)
 
             staff_symbol_list.append(symbol_list)
 
+        for model_path, classes, group_symbols, canvases in pending.values():
+            classify_batch(model_path, classes, group_symbols, canvases)
+
         symbol_pitch_list[sourcefile] = staff_symbol_list
-        os.remove(preprocessed_path)
 
         end = time.time()
         cprint(f"Classified {classified_symbols} pitches in {end - start} seconds", "green")
@@ -0,0 +1,61 @@
+"""
+INT8 Quantization of the Pitch Classifiers
+
+This script quantizes the three ONNX classifiers used by pitch detection
+(`all_symbols`, `clef` and `mensuration`) to INT8 weights with ONNX
+Runtime's dynamic quantization. The quantized models move half the
+weight bytes of the original models and usually run faster on the CPU.
+
+The quantized models are written to the pathes in
+`config.QUANTIZED_MODEL_PATHES`. Pitch detection uses them once
+`config.USE_QUANTIZED_CLASSIFIERS` is set to True.
+
+Functions:
+    quantize_classifiers(): Quantizes the classifiers and saves the
+        quantized models.
+
+Example:
+    Run the script once from the project directory after downloading the
+    models:
+
+        python -m mensural_to_mei.pitch_detection.quantize_models
+
+Note:
+    Quantization can change single classifications. Compare the results
+    of some pages before using the quantized models. The object detection
+    models are not quantized, they would need static quantization with a
+    calibration set of pages to keep their detection accuracy.
+    ONNX Runtime's quantization tools need the `onnx` package
+    (`pip install onnx`), which is not required for the conversion itself.
+"""
+
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+from mensural_to_mei.configs import config
+from mensural_to_mei.utils import check_files_exist
+from colorama import just_fix_windows_console
+from termcolor import cprint
+
+just_fix_windows_console()
+
+
+def quantize_classifiers() -> None:
+    """
+    Quantizes the pitch classifiers to INT8 weights.
+
+    Raises
+    ------
+    FileNotFoundError
+        If one of the classifier models does not exist.
+    """
+    for model_name, quantized_path in config.QUANTIZED_MODEL_PATHES.items():
+        model_path = config.MODEL_PATHES[model_name]
+        check_files_exist(model_path)
+
+        cprint(f"Quantizing {model_path}", "blue")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        cprint(f"Saved quantized model to {quantized_path}", "green")
+
+
+if __name__ == "__main__":
+    quantize_classifiers()
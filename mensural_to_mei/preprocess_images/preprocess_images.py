@@ -4,8 +4,10 @@ noise removal, resizing, and normalization. It is designed to work with
 images in a numpy array format and utilizes OpenCV for image operations.
 
 The script includes the following functions:
-- remove_noise: Applies Fast Non-Local Means Denoising to remove noise from images.
+- remove_noise: Removes noise from images with the filter set in config.DENOISE_FILTER.
 - calc_new_dimensions: Calculates new dimensions for an image to fit a specified size while maintaining aspect ratio.
+- get_interpolation: Chooses the resize interpolation for a given resize factor.
+- pad_to_canvas: Writes a resized image centered on a white canvas.
 - process_image: Processes an image by converting it to grayscale, denoising, normalizing, and resizing.
 - preprocess_images: Preprocesses a list of images according to configurations specified in a YAML file.
 
@@ -23,14 +25,16 @@ Note:
     The script assumes that the configuration file 'config_images.yaml' is located in the 'configs' directory.
 """
 
+import math
 import cv2
 import numpy as np
+from mensural_to_mei.configs import config
 from mensural_to_mei.utils import load_configs
 import os
 
 def remove_noise(image: np.ndarray) -> np.ndarray:
     """
-    Applies Fast Non-Local Means Denoising to an image to remove noise.
+    Removes noise from an image with the filter set in config.DENOISE_FILTER.
 
     Parameters
     ----------
@@ -42,21 +46,20 @@ def remove_noise(image: np.ndarray) -> np.ndarray:
     np.ndarray
         The denoised image.
 
+    Raises
+    ------
+    ValueError
+        If config.DENOISE_FILTER is not a known filter.
+
     Notes
     -----
-    The function uses the Fast Non-Local Means Denoising algorithm, which
-    works by considering a template patch around each pixel and computing
-    a weighted average of similar patches found in a larger search window.
-
-    The parameters for the algorithm are:
-    - h: The filtering strength. Higher values remove noise but also remove
-    image details. If None, the value is calculated as 3*sigma + 1.
-    - templateWindowSize: Size of the template patch used for denoising.
-    Should be odd and greater than h.
-    - searchWindowSize: Size of the window used to search for patches.
-    Should be odd and greater than templateWindowSize.
-    - normType: Type of norm used for denoising. Options are cv2.NORM_L1,
-    cv2.NORM_L2, or cv2.NORM_MINMAX.
+    The available filters are:
+    - 'median': A 3x3 median filter. It removes the salt-and-pepper noise
+    of scanned pages at a fraction of the cost of non-local means.
+    - 'nlmeans': Fast Non-Local Means Denoising, which computes a weighted
+    average of similar 7x7 patches found in a 21x21 search window. It is
+    considerably slower on full pages.
+    - None: The image is returned unchanged.
 
     Example
     -------
@@ -65,7 +68,14 @@ def remove_noise(image: np.ndarray) -> np.ndarray:
     >>> cv2.imwrite('path/to/denoised_image.jpg', denoised_image)
     """
 
-    return cv2.fastNlMeansDenoising(image, None, 10, 10, cv2.NORM_MINMAX)
+    if config.DENOISE_FILTER is None:
+        return image
+    if config.DENOISE_FILTER == 'median':
+        return cv2.medianBlur(image, 3)
+    if config.DENOISE_FILTER == 'nlmeans':
+        return cv2.fastNlMeansDenoising(image, None, h=10, templateWindowSize=7, searchWindowSize=21)
+
+    raise ValueError(f"Unknown denoise filter: {config.DENOISE_FILTER}")
 
 def calc_new_dimensions(img: np.ndarray, new_size: tuple) -> tuple:
     """
@@ -114,8 +124,9 @@ def calc_new_dimensions(img: np.ndarray, new_size: tuple) -> tuple:
 
     resize_factor = min(resize_h, resize_w)
 
-    new_width = np.ceil(min(w * resize_factor, new_size[0])).astype(int)
-    new_height = np.ceil(min(h * resize_factor, new_size[1])).astype(int)
+    # plain python arithmetic, numpy scalar operations are much slower for single values
+    new_width = math.ceil(min(w * resize_factor, new_size[0]))
+    new_height = math.ceil(min(h * resize_factor, new_size[1]))
 
     offset_w = (new_size[0] - new_width) // 2
     offset_h = (new_size[1] - new_height) // 2
@@ -123,24 +134,40 @@ def calc_new_dimensions(img: np.ndarray, new_size: tuple) -> tuple:
 
     return new_width, new_height, padding, resize_factor
 
+def get_interpolation(resize_factor: float) -> int:
+    """ area interpolation for downscaling, lanczos only for upscaling """
+    return cv2.INTER_AREA if resize_factor < 1 else cv2.INTER_LANCZOS4
+
+def pad_to_canvas(image: np.ndarray, padding: tuple, canvas: np.ndarray) -> None:
+    """ writes the image centered on the canvas and fills the border white in a single pass """
+    cv2.copyMakeBorder(image, padding[0], canvas.shape[0] - padding[1], padding[2], canvas.shape[1] - padding[3],
+                       cv2.BORDER_CONSTANT, dst=canvas, value=255)
+
 def process_image(
         source_img: np.ndarray,
         new_size: tuple,
         rescale: bool=True,
+        denoise: bool=True,
 ) -> tuple:
     """
     Processes an image by converting it to grayscale, denoising, normalizing,
     and resizing based on the given parameters.
 
+    The processed image stays single-channel, the inference functions feed
+    it to every input channel of the models.
+
     Parameters
     ----------
     source_img : np.ndarray
-        The source image to be processed.
+        The source image to be processed, either BGR or already grayscale.
     new_size : tuple
         The desired size (width, height) for the output image.
     rescale : bool, optional
         A flag that determines whether to resize the image or not. The default
         is True.
+    denoise : bool, optional
+        A flag that determines whether to remove noise from the image. Set it
+        to False for images that were already denoised. The default is True.
 
     Returns
     -------
@@ -164,12 +191,15 @@ def process_image(
     >>> new_size = (800, 600)
     >>> processed_img, padding, resize_factor = process_image(source_img, new_size)
     >>> print(processed_img.shape)
-    (600, 800, 3)
+    (600, 800)
     """
 
-    grayscale_image = cv2.cvtColor(source_img, cv2.COLOR_BGR2GRAY)
+    if source_img.ndim == 3:
+        grayscale_image = cv2.cvtColor(source_img, cv2.COLOR_BGR2GRAY)
+    else:
+        grayscale_image = source_img
 
-    denoized_image = remove_noise(grayscale_image)
+    denoized_image = remove_noise(grayscale_image) if denoise else grayscale_image
 
     norm_img = np.zeros((source_img.shape[0], source_img.shape[1]))
     normed = cv2.normalize(denoized_image, norm_img, 0, 255, cv2.NORM_MINMAX)
@@ -178,17 +208,14 @@ def process_image(
         new_width, new_height, padding, resize_factor = calc_new_dimensions(
             normed, new_size
         )
-        resized_image = cv2.resize(normed, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+        resized_image = cv2.resize(normed, (new_width, new_height), interpolation=get_interpolation(resize_factor))
         
-        processed_image = np.zeros(new_size, dtype=np.uint8)
-        processed_image.fill(255)
-        # copy the resized image to the center of the new image
-        processed_image[padding[0]:padding[1], padding[2]:padding[3]] = resized_image
+        processed_image = np.empty((new_size[1], new_size[0]), dtype=np.uint8)
+        # copy the resized image to the center of the new white image
+        pad_to_canvas(resized_image, padding, processed_image)
     else:
         processed_image = normed
         padding = (0, 0, 0, 0)
         resize_factor = 1
 
-    processed_image = cv2.cvtColor(processed_image, cv2.COLOR_GRAY2BGR)
-    
     return processed_image, padding, resize_factor
@@ -11,12 +11,14 @@ Functions
 - check_for_output_folders()
     Checks for the existence of output folders and creates them if 
     they do not exist.
+- get_cache_path(image_sources)
+    Returns the cache file of the detections of the given images.
 - select_sources(source, pages)
     Selects image sources based on provided directory and page numbers.
-- do_detection(image_sources)
-    Detects musical symbols in the given image sources.
-- detect_pitches(all_found_symbols)
-    Detects pitches from the detected musical symbols.
+- detect_pages(image_sources)
+    Detects musical symbols in the given image sources, page by page.
+- detect_pitches(found_symbols, preprocessed_images)
+    Detects pitches from the detected musical symbols of each page.
 - conversion_pipeline(source='', pages='', humdrum=False, debug=False)
     Main function that orchestrates the conversion pipeline.
 
@@ -35,21 +37,27 @@ to 'symbols_and_pitches.pkl':
 
 Notes
 -----
-The script requires the 'pickle' module for debugging purposes and
+The script uses 'save_picklable_items' from 'mensural_to_mei.utils' for debugging purposes and
 functions from the 'mensural_to_mei' package for the conversion process.
+
+The detected symbols and pitches are cached in `config.DETECTION_CACHE_FOLDER`,
+so converting the same images again skips the detection.
 """
 
+import glob
+import hashlib
 import os
-import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from colorama import just_fix_windows_console
 from termcolor import cprint
 from mensural_to_mei.configs import config
 from mensural_to_mei.convert_detections.convert_to_mei_and_humdrum import convert_to_mei_and_humdrum
-from mensural_to_mei.object_detection.do_detection import do_detection
+from mensural_to_mei.object_detection.do_detection import detect_pages, load_detection_models
 from mensural_to_mei.pitch_detection.detect_pitches import detect_pitches
 from mensural_to_mei.select_sources.select_sources import select_sources
+from mensural_to_mei.utils import load_pickle, save_picklable_items
 
 just_fix_windows_console()
 
@@ -71,6 +79,53 @@ def check_for_output_folders() -> None:
             cprint(f"Creating folder: {output_folder}", "green", "on_white")
             os.makedirs(output_folder)
 
+def get_cache_path(image_sources: list) -> str:
+    """
+    Returns the cache file of the detections of the given images.
+
+    The file name is a hash of the image names and contents, the models,
+    the label files, the detection code and the settings the detection
+    depends on.
+
+    Parameters
+    ----------
+    image_sources : list
+        The image files to convert.
+
+    Returns
+    -------
+    str
+        Path of the cache file in `config.DETECTION_CACHE_FOLDER`.
+    """
+    manifest = hashlib.blake2b(digest_size=16)
+
+    settings = (config.RESCALE, config.IMAGE_SIZE, config.STAFF_SIZE, config.SYMBOL_SIZE,
+                config.DENOISE_FILTER, config.USE_QUANTIZED_CLASSIFIERS)
+    manifest.update(repr(settings).encode())
+
+    # replaced models or labels invalidate the cache
+    for path in [*config.MODEL_PATHES.values(), *config.QUANTIZED_MODEL_PATHES.values(), *config.LABEL_PATHES.values()]:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            manifest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    # changes of the preprocessing, detection or classification code invalidate the cache
+    package_folder = os.path.dirname(os.path.abspath(__file__))
+    for code_folder in ("object_detection", "pitch_detection", "preprocess_images"):
+        for code_file in sorted(glob.glob(os.path.join(package_folder, code_folder, "*.py"))):
+            with open(code_file, "rb") as file:
+                manifest.update(file.read())
+    with open(os.path.join(package_folder, "utils.py"), "rb") as file:
+        manifest.update(file.read())
+
+    for image_path in image_sources:
+        manifest.update(os.path.basename(image_path).encode())
+        with open(image_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                manifest.update(chunk)
+
+    return os.path.join(config.DETECTION_CACHE_FOLDER, f"symbols_{manifest.hexdigest()}.pkl")
+
 def conversion_pipeline(
         source: str = '',
         pages: str = '',
@@ -80,16 +135,40 @@ def conversion_pipeline(
 
     start_time = time.time()
     
+    # load the detection models while the sources are selected and pdf pages are converted
+    executor = ThreadPoolExecutor(max_workers=1)
+    models_loaded = executor.submit(load_detection_models)
+    # the loading is only waited for when the detection runs, cached detections do not need the models
+    executor.shutdown(wait=False)
+
     image_sources = select_sources(source, pages)
-    
-    all_found_symbols = do_detection(image_sources)
 
-    symbols_and_pitches = detect_pitches(all_found_symbols)
+    cache_path = get_cache_path(image_sources) if config.DETECTION_CACHE_FOLDER else None
+
+    symbols_and_pitches = None
+    if cache_path and os.path.exists(cache_path):
+        cprint(f"Loading cached detections from {cache_path}", "green")
+        try:
+            symbols_and_pitches = load_pickle(cache_path)
+        except Exception as error:
+            # an unreadable cache file is treated like a missing one and written again
+            cprint(f"Ignoring unreadable cache file {cache_path}: {error}", "yellow")
+
+    if symbols_and_pitches is None:
+        models_loaded.result()
+
+        # classify the pitches of each page right after its detection, so its image can be released
+        symbols_and_pitches = {}
+        for filename, file_symbols, grayscale_image in detect_pages(image_sources):
+            symbols_and_pitches.update(detect_pitches({filename: file_symbols}, {filename: grayscale_image}))
+
+        if cache_path:
+            os.makedirs(config.DETECTION_CACHE_FOLDER, exist_ok=True)
+            save_picklable_items(symbols_and_pitches, cache_path)
     
     if config.DEBUG_MODE:
         # save detection for debug of following function to avoid unnecessary detection steps
-        with open("symbols_and_pitches.pkl", "wb") as f:
-            pickle.dump(symbols_and_pitches, f, protocol=pickle.HIGHEST_PROTOCOL)
+        save_picklable_items(symbols_and_pitches, "symbols_and_pitches.pkl")
     
     convert_to_mei_and_humdrum(symbols_and_pitches, humdrum)
 
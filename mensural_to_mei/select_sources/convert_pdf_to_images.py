@@ -4,37 +4,69 @@ This script contains functions to convert a PDF file to a series of images.
 The `convert_pdf` function takes a PDF file name, resolution in dots per inch (dpi),
 output path, and pages to convert as input. It converts the specified pages of the
 PDF file to images at the specified resolution and saves them to the specified
-output path.
-
-The `rename_pdf_image` function takes a PDF file name, an image file name, and a side
-indicator as input. It renames the image file based on the PDF file name, the index
-of the image in the PDF file, and the side indicator.
+output path under their final names (`<pdf name>_<page>.jpg`). The pages are
+converted in parallel in contiguous chunks, see `split_into_chunks`. The
+resolution is taken from the configuration, see `get_pdf_dpi`.
 
 The `convert_pdf_to_images` function takes a PDF file name, a boolean indicating
-whether the PDF file contains two-sided pages, pages to convert, a PDF output
-folder, and a PDF temp folder as input. It converts the specified pages of the
-PDF file to images and saves them to the specified output folder. The function
-uses the `convert_pdf` and `rename_pdf_image` functions to perform the conversion
-and renaming.
+whether the PDF file contains two-sided pages, pages to convert and a PDF output
+folder as input. It converts the specified pages of the PDF file to images and
+saves them to the specified output folder. The function uses the `convert_pdf`
+function to perform the conversion.
 
-Please refer to the docstrings of the `convert_pdf`, `rename_pdf_image`, and
+Please refer to the docstrings of the `convert_pdf` and
 `convert_pdf_to_images` functions for more details about their parameters and
 return values.
 """
 
-import glob
+import math
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
+from mensural_to_mei.configs import config
 from mensural_to_mei.utils import remove_files
-from pdf2image import convert_from_path
-
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+
+def parse_page_ranges(pages_to_convert: str) -> list[tuple[int, int]]:
+    """ parses pages like '1-3,5' into a list of (first_page, last_page) tuples """
+    page_ranges = []
+    for pages in pages_to_convert.split(","):
+        if "-" in pages:
+            first_page, last_page = pages.split("-")
+        else:
+            first_page = last_page = pages
+        page_ranges.append((int(first_page), int(last_page)))
+
+    return page_ranges
+
+def get_pdf_dpi(pdf_info: dict) -> int:
+    """ returns the resolution of the converted pages, derived from the first page if a target width is set """
+    if not config.PDF_TARGET_WIDTH:
+        return config.PDF_DPI
+
+    # pdfinfo gives the size of the first page in points (1/72 inch), e.g. '595.276 x 841.89 pts (A4)'
+    page_width = float(pdf_info["Page size"].split()[0])
+    return max(100, math.ceil(config.PDF_TARGET_WIDTH * 72 / page_width))
+
+def split_into_chunks(pages: list[int], chunk_count: int) -> list[tuple[int, int]]:
+    """ splits sorted pages into contiguous (first_page, last_page) runs of at most len(pages) / chunk_count pages """
+    chunk_size = math.ceil(len(pages) / chunk_count)
+    chunks = []
+    for page in pages:
+        first_page, last_page = chunks[-1] if chunks else (0, -1)
+        if page == last_page + 1 and last_page - first_page + 1 < chunk_size:
+            chunks[-1] = (first_page, page)
+        else:
+            chunks.append((page, page))
+
+    return chunks
 
 def convert_pdf(
         filename: str = "",
-        dpi: int = 300,
-        output_path: str = "pdf_temp",
+        dpi: int | None = None,
+        output_path: str = "pdf_images",
         pages_to_convert: str = ""
 ) -> None:
     """
@@ -50,10 +82,10 @@ def convert_pdf(
         The name of the PDF file to convert. Defaults to an empty string.
     dpi : int, optional
         The resolution in dots per inch at which to convert the PDF
-        pages. Defaults to 300.
+        pages. Defaults to the resolution returned by `get_pdf_dpi`.
     output_path : str, optional
         The path where the converted images will be saved. Defaults to
-        "pdf_temp".
+        "pdf_images".
     pages_to_convert : str, optional
         A string specifying the pages to convert, formatted as a
         comma-separated list of page ranges. For example, "1-3,5" would
@@ -63,75 +95,75 @@ def convert_pdf(
     Returns
     -------
     None
-    """
-
-    remove_files(output_path)
-
-    pdf_file = filename
-    test_images = {}
-
-    if pages_to_convert != "":
-        list_of_pages = pages_to_convert.split(",")
 
-        for i in list_of_pages:
-            test_image = None
-            if "-" in i:
-                page_range = i.split("-")
-                first_page = int(page_range[0])
-                last_page = int(page_range[1])
-            else:
-                first_page = int(i)
-                last_page = int(i)
+    Notes
+    -----
+    The pages are split into one contiguous chunk per worker (all but one
+    core), and every chunk is rasterized by a single pdftoppm run (or
+    pdftocairo, see `config.PDF_USE_PDFTOCAIRO`), so the PDF is parsed once
+    per chunk instead of once per page. The images of a chunk are renamed
+    within the output folder to their final names (e.g. 'score_0005.jpg'
+    for page 5 of 'score.pdf').
+    """
 
-            test_image = convert_from_path(
-                pdf_file,
+    pdf_info = pdfinfo_from_path(filename)
+    if pages_to_convert == "":
+        pages = list(range(1, pdf_info["Pages"] + 1))
+    else:
+        # pages listed in several ranges are converted once
+        pages = sorted({
+            page
+            for first_page, last_page in parse_page_ranges(pages_to_convert)
+            for page in range(first_page, last_page + 1)
+        })
+
+    if dpi is None:
+        dpi = get_pdf_dpi(pdf_info)
+
+    conversion_options = {
+        "fmt": "jpeg",
+        "dpi": dpi,
+        "jpegopt": {"quality": 95},
+        "output_folder": output_path,
+        # the images are only needed on disk, do not load them into memory
+        "paths_only": True,
+        "use_pdftocairo": config.PDF_USE_PDFTOCAIRO,
+    }
+    available_threads = max(1, (os.cpu_count() or 1) - 1)
+    pdf_basename = os.path.basename(filename)[:-4]
+
+    with ThreadPoolExecutor(max_workers=available_threads) as executor:
+        futures = [
+            executor.submit(
+                convert_from_path,
+                filename,
                 first_page=first_page,
                 last_page=last_page,
-                fmt="jpeg",
-                dpi=dpi,
-                jpegopt={"quality": 95},
-                output_folder=output_path,
-                output_file="pdf",
-                thread_count=4
+                # pdftoppm appends '-<page>' to the names of a chunk
+                output_file=f"{pdf_basename}_part{first_page:04d}_",
+                **conversion_options
             )
-
-        return None
-
-    test_images = convert_from_path(
-        pdf_file,
-        fmt="jpeg",
-        dpi=dpi,
-        jpegopt={"quality": 95},
-        output_folder=output_path,
-        output_file="pdf",
-        thread_count=4
-    )
-    return
-
-def rename_pdf_image(pdf_name: str, f_name: str, side_indicator="") -> str:
-    """ renames pdf image """
-    f_name_parts = f_name.split("-")
-    index = int(f_name_parts[1][:-4])
-    pdf_basename = os.path.basename(pdf_name)
-    new_f_name = f"{pdf_basename[:-4]}_{index:04d}{side_indicator}.jpg"
-    return new_f_name
+            for first_page, last_page in split_into_chunks(pages, available_threads)
+        ]
+        for future in tqdm(as_completed(futures), "convert pdf pages", total=len(futures)):
+            for image_path in future.result():
+                page = int(os.path.splitext(image_path)[0].rsplit("-", 1)[1])
+                os.replace(image_path, os.path.join(output_path, f"{pdf_basename}_{page:04d}.jpg"))
 
 def convert_pdf_to_images(
         pdf_name: str,
         two_sided: bool,
         pages_to_convert: str,
-        pdf_output_folder: str,
-        pdf_temp_folder: str) -> None:
+        pdf_output_folder: str) -> None:
     """
     Converts specified pages of a PDF file into images and saves them 
     to a specified folder.
 
     This function takes a PDF file name, a boolean indicating whether 
-    the PDF file contains two-sided pages, pages to convert, a PDF 
-    output folder, and a PDF temp folder as input. It converts the 
-    specified pages of the PDF file to images and saves them to the 
-    specified output folder. The function uses the `convert_pdf` and 
-    `rename_pdf_image` functions to perform the conversion and renaming.
+    the PDF file contains two-sided pages, pages to convert and a PDF 
+    output folder as input. It removes the images of previous 
+    conversions from the output folder and converts the specified pages 
+    of the PDF file to images with the `convert_pdf` function.
 
     Parameters
     ----------
@@ -144,9 +176,6 @@ def convert_pdf_to_images(
         comma-separated list of page ranges.
     pdf_output_folder : str
         The folder where the converted images will be saved.
-    pdf_temp_folder : str
-        The folder where temporary files will be saved during the 
-        conversion process.
 
     Returns
     -------
@@ -155,13 +184,6 @@ def convert_pdf_to_images(
     
     remove_files(pdf_output_folder)
 
-    pdf_pages = convert_pdf(
-        pdf_name, pages_to_convert=pages_to_convert, output_path=pdf_temp_folder)
-    
-    pdf_pages = sorted(glob.glob(os.path.join(pdf_temp_folder, "*.jpg")))
-
-    for f_name in tqdm(pdf_pages, "move to pdf-folder"):
-        new_f_name = rename_pdf_image(pdf_name, f_name)
-        shutil.move(f_name, os.path.join(pdf_output_folder, new_f_name))
+    convert_pdf(pdf_name, pages_to_convert=pages_to_convert, output_path=pdf_output_folder)
     
     return
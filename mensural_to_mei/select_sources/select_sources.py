@@ -32,7 +32,7 @@ import os
 import sys
 from mensural_to_mei.configs import config
 from mensural_to_mei.select_sources.convert_pdf_to_images import convert_pdf_to_images
-from mensural_to_mei.utils import check_files_exist
+from mensural_to_mei.utils import check_all_files_exist, check_files_exist
 from colorama import just_fix_windows_console
 from termcolor import cprint
 
@@ -78,18 +78,16 @@ def select_sources(sources: str, pages: str) -> list:
             sys.exit(-1)
 
         # convert pdf to images
-        convert_pdf_to_images(sources, True, pages, config.OUTPUT_FOLDERS['pdf_images'], config.OUTPUT_FOLDERS['pdf_temp'])
+        convert_pdf_to_images(sources, True, pages, config.OUTPUT_FOLDERS['pdf_images'])
 
         # get sorted list of pdf images
         filenames = sorted(glob.glob(os.path.join(config.OUTPUT_FOLDERS['pdf_images'], "*.jpg")))
     elif extension == '.csv':
         # read sources from csv
-        filenames = []
         with open(sources, 'r') as file:
             csv_reader = csv.reader(file, delimiter=',')
-            for row in csv_reader:
-                check_files_exist(row[0])
-                filenames.append(row[0])
+            filenames = [row[0] for row in csv_reader]
+        check_all_files_exist(filenames)
     else:
         if extension == '.jpg' or extension == '.png':
             filenames = [sources]
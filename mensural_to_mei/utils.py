@@ -12,6 +12,8 @@ Functions:
         dictionary.
     check_files_exist(file): Checks if a file exists and raises a
         FileNotFoundError if not.
+    check_all_files_exist(files): Checks a list of files with one
+        directory scan per folder.
     remove_files(folder_path): Removes all files within a specified folder
         path.
     load_program_folders(config_path): Loads program folder paths from a
@@ -30,6 +32,11 @@ Functions:
         readable manner.
     convert_to_combined_list_with_metadata(d): Converts a dictionary of lists
         into a combined list with corresponding metadata.
+    save_pickle(obj, file_path): Saves an object as pickle with out-of-band
+        buffers.
+    load_pickle(file_path): Loads an object saved with save_pickle.
+    save_picklable_items(d, file_path): Saves the items of a dictionary
+        that can be pickled with save_pickle.
 
 The script is designed to be modular and reusable for various tasks that
 require data manipulation and analysis, particularly in machine learning
@@ -44,27 +51,33 @@ Example:
 
 Note:
     The script assumes the presence of certain libraries such as 'numpy',
-    'yaml', 'itertools', and 'lxml'. It also assumes
+    'yaml', and 'lxml'. It also assumes
     a specific project structure for loading configurations.
 """
 
 
-import glob
+import functools
 import os
+import pickle
 import random
 import string
+import struct
 import cv2
 import numpy as np
 import yaml
-import itertools
 
 from lxml import etree
+from termcolor import cprint
 
+# the libyaml based loader is much faster, PyYAML may be installed without it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
+
+@functools.lru_cache(maxsize=None)
 def load_yaml(file_path: str) -> dict:
-    """ load yaml form given path """
+    """ load yaml form given path, the parsed file is cached and must not be modified """
     with open(file_path, "r") as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=_YAML_LOADER)
 
 
 def check_files_exist(file: str) -> None:
@@ -73,12 +86,45 @@ def check_files_exist(file: str) -> None:
         raise FileNotFoundError(f"{file} does not exist.")
 
 
+def check_all_files_exist(files: list) -> None:
+    """ check if all files exist, listing each folder once instead of checking every file """
+    folder_entries = {}
+    for file in files:
+        folder, name = os.path.split(file)
+        if folder not in folder_entries:
+            try:
+                with os.scandir(folder or ".") as entries:
+                    folder_entries[folder] = {entry.name for entry in entries}
+            except OSError:
+                folder_entries[folder] = set()
+
+        # names not listed (e.g. other case on case-insensitive file systems) are checked directly
+        if name not in folder_entries[folder]:
+            check_files_exist(file)
+
+
 def remove_files(folder_path: str) -> None:
     """ remove all files in a folder """
-    del_path = os.path.join(folder_path, "**.*")
-    files = glob.glob(del_path)
-    for f in files:
-        os.remove(f)
+    if not os.path.isdir(folder_path):
+        return
+
+    if os.unlink not in os.supports_dir_fd or os.scandir not in os.supports_fd:
+        # stream the directory entries instead of matching a list of all names
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    os.unlink(entry.path)
+        return
+
+    # unlink relative to the open folder like shutil.rmtree, so the folder path is not resolved per file
+    folder_fd = os.open(folder_path, os.O_RDONLY)
+    try:
+        with os.scandir(folder_fd) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    os.unlink(entry.name, dir_fd=folder_fd)
+    finally:
+        os.close(folder_fd)
 
 def load_program_folders(config_path: str) -> dict:
     """ load program folders from configs.yaml """
@@ -88,9 +134,6 @@ def load_program_folders(config_path: str) -> dict:
 
 def load_configs(config_path: str) -> dict:
     """ load configs from configs.yaml """
-    project_root = "mensural_to_mei"
-    config_path = os.path.join(project_root, "configs", "configs.yaml")
-
     configs = load_yaml(config_path)
     return configs
 
@@ -123,28 +166,38 @@ def do_onnx_analysis(output: list) -> list:
     [[x_min, y_min, x_max, y_max], ...] [class_id1, class_id2, ...]
     """
 
-    outputs = np.transpose(np.squeeze(output[0]))
-    scores = np.max(outputs[:, 4:], axis=1)
-    # select the boxes with scores > 0.5
-    predictions = outputs[scores > 0.5, :]
-    scores = scores[scores > 0.5]
-    class_ids = np.argmax(predictions[:, 4:], axis=1)
-    boxes = predictions[:, :4]
+    # keep the (4 + classes, boxes) layout of the model, the reductions then run along contiguous rows
+    outputs = output[0]
+    if outputs.ndim == 3:
+        outputs = outputs[0]
+    scores = np.max(outputs[4:], axis=0)
+    # select the boxes with scores > 0.5 once, only their class scores and boxes are gathered
+    selected = np.flatnonzero(scores > 0.5)
+    if not len(selected):
+        return [], []
+    scores = scores[selected]
+    class_ids = np.argmax(outputs[4:, selected], axis=0)
+    boxes = outputs[:4, selected].T
     conv_boxes = convert_boxes_from_cxcywh_to_xywh(boxes)
 
+    # OpenCV's NMS runs in C++ and was faster than a vectorized NumPy NMS for all box counts.
+    # It is class-agnostic on purpose, so one symbol detected with two classes is kept only once.
     remaining_boxes = cv2.dnn.NMSBoxes(conv_boxes, scores, 0.5, 0.5)
 
-    nms_boxes = conv_boxes[remaining_boxes].astype(int)
+    # pixel coordinates fit into int32, the casted copy is the only integer array
+    nms_boxes = conv_boxes[remaining_boxes].astype(np.int32)
     nms_labels = class_ids[remaining_boxes].tolist()
 
-    nms_boxes = convert_boxes_from_xywh_to_xyxy(nms_boxes).tolist()
+    # convert the integer boxes from xywh to xyxy in place, x and w are truncated separately
+    nms_boxes[:, 2:] += nms_boxes[:, :2]
+    nms_boxes = nms_boxes.tolist()
 
     return nms_boxes, nms_labels
 
 
 def count_elements(nested_list: list) -> int:
     """ Counts the number of elements in a nested list """
-    return len(list(itertools.chain.from_iterable(nested_list)))
+    return sum(map(len, nested_list))
 
 
 def generate_random_string(length: int) -> str:
@@ -155,13 +208,9 @@ def generate_random_string(length: int) -> str:
 
 def generate_random_numbers(num_elements: int) -> list:
     """ Generates a list of random numbers of the specified length. """
-    # Initialize an empty set to store unique random numbers
-    numbers = set()
-    while len(numbers) < num_elements:
-        # Generate a random number by choosing 10 digits at random and joining them to form a string
-        random_number = "".join(random.choices(string.digits, k=10))
-        numbers.add(random_number)
-    return list(numbers)
+    # Draw unique numbers below 10^10 without replacement and format them as strings of 10 digits
+    numbers = np.random.default_rng().choice(10**10, size=num_elements, replace=False)
+    return [f"{number:010d}" for number in numbers.tolist()]
 
 
 def prettyprint(element: etree.Element, **kwargs) -> None:
@@ -184,45 +233,89 @@ def convert_to_combined_list_with_metadata(d: dict) -> tuple:
     return combined_list, metadata
 
 
-def convert_boxes_from_cxcywh_to_xyxy(boxes):
-    """ Converts boxes from cxcywh to xyxy format. """
-    x_center = boxes[:, 0]
-    y_center = boxes[:, 1]
-    width = boxes[:, 2]
-    height = boxes[:, 3]
-
-    x_min = x_center - width / 2
-    y_min = y_center - height / 2
-    x_max = x_center + width / 2
-    y_max = y_center + height / 2
-
-    converted_boxes = np.column_stack((x_min, y_min, x_max, y_max))
-    return converted_boxes
-
 def convert_boxes_from_cxcywh_to_xywh(boxes):
     """ Converts boxes from cxcywh to xywh format. """
-    x_center = boxes[:, 0]
-    y_center = boxes[:, 1]
-    width = boxes[:, 2]
-    height = boxes[:, 3]
+    # same dtype as boxes / 2: floats are kept, integers become float64
+    dtype = boxes.dtype if np.issubdtype(boxes.dtype, np.floating) else np.float64
+    converted_boxes = np.empty(boxes.shape, dtype=dtype)
+    np.divide(boxes[:, 2:], 2, out=converted_boxes[:, :2])
+    np.subtract(boxes[:, :2], converted_boxes[:, :2], out=converted_boxes[:, :2])
+    converted_boxes[:, 2:] = boxes[:, 2:]
+    return converted_boxes
 
-    x = x_center - width / 2
-    y = y_center - height / 2
 
-    converted_boxes = np.column_stack((x, y, width, height))
-    return converted_boxes
+def save_pickle(obj, file_path: str) -> None:
+    """
+    Saves an object as pickle (protocol 5) with out-of-band buffers.
 
-def convert_boxes_from_xywh_to_xyxy(boxes):
-    """ Converts boxes from xywh to xyxy format. """
-    x = boxes[:, 0]
-    y = boxes[:, 1]
-    width = boxes[:, 2]
-    height = boxes[:, 3]
+    Buffers of contiguous arrays (e.g. numpy arrays) are not copied into
+    the pickle stream but written as raw bytes after it. The pickle stream
+    is written directly into a 1 MiB file buffer. The file ends with the
+    length of the pickle stream, the length of each buffer and the number
+    of buffers as unsigned 64 bit integers.
 
-    xmin = x
-    ymin = y
-    xmax = x + width
-    ymax = y + height
+    The file is written to a temporary file first and moved into place
+    when it is complete, so an interrupted save leaves no truncated file.
 
-    converted_boxes = np.column_stack((xmin, ymin, xmax, ymax))
-    return converted_boxes
\ No newline at end of file
+    Parameters
+    ----------
+    obj : object
+        The object to save.
+    file_path : str
+        Path of the pickle file.
+    """
+    buffers = []
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb", buffering=1 << 20) as file:
+            pickle.Pickler(file, protocol=5, buffer_callback=buffers.append).dump(obj)
+            data_length = file.tell()
+
+            raw_buffers = [buffer.raw() for buffer in buffers]
+            for raw in raw_buffers:
+                file.write(raw)
+            file.write(struct.pack(f"<{len(raw_buffers) + 2}Q", data_length, *(raw.nbytes for raw in raw_buffers), len(raw_buffers)))
+
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def load_pickle(file_path: str):
+    """ loads an object saved with save_pickle, the buffers are not copied """
+    with open(file_path, "rb") as file:
+        content = memoryview(file.read())
+
+    n_buffers = struct.unpack_from("<Q", content, len(content) - 8)[0]
+    data_length, *buffer_lengths = struct.unpack_from(f"<{n_buffers + 1}Q", content, len(content) - 8 * (n_buffers + 2))
+
+    data = content[:data_length]
+    offset = data_length
+
+    buffers = []
+    for length in buffer_lengths:
+        buffers.append(content[offset:offset + length])
+        offset += length
+
+    return pickle.loads(data, buffers=buffers)
+
+
+def save_picklable_items(d: dict, file_path: str) -> None:
+    """ saves a dict with save_pickle, items that can not be pickled are dropped and reported """
+    try:
+        save_pickle(d, file_path)
+        return
+    except (pickle.PicklingError, TypeError, AttributeError):
+        pass
+
+    dropped = []
+    for key, value in d.items():
+        try:
+            # array buffers are kept out-of-band, so they are not copied for the check
+            pickle.dumps(value, protocol=5, buffer_callback=lambda buffer: None)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            cprint(f"{key} can not be pickled and is not saved: {error}", "yellow")
+            dropped.append(key)
+
+    save_pickle({key: value for key, value in d.items() if key not in dropped}, file_path)